@@ -24,7 +24,28 @@ import sys
 import os
 import time
 import re
+import socket
+import collections
+import cProfile
+import pstats
+import subprocess
+import threading
+import queue
+import atexit
+import signal
+import json
+import gzip
+import functools
+import hashlib
+import mmap
+import contextlib
+import traceback
+import my_ict
 from my_ict import *
+from picb_parse import BoardVer, parse_noise, parse_diog, parse_ver, parse_mcu_serial
+from picb_plan import plan_compile
+from picb_results import ResultStore
+from picb_log import log_run_extract, log_rotate, archive_sweep
 
 
 
@@ -40,8 +61,124 @@ FPGA_BIN        = ''
 DUMMY_FF_BIN    = '0xFF.bin'
 FPGA_DB_VER     = 'FPGA:99.1'
 
-DAC_PER_VOLT12  = 4095.0/3.3
-LLS_NOISE_LIMIT = 50
+# steps, limits and expected values, see picb_plan.py
+PLAN_FILE       = os.environ.get('PICB_PLAN', os.path.join(
+                      os.path.dirname(os.path.abspath(__file__)), 'picb_plan.json'))
+
+# settle wait: consecutive readings within tolerance, never longer than the
+# fixed delays used before (1 s relay, 0.1 s MUX / gain)
+SETTLE_POLL     = 0.02      # seconds between settle readings
+SETTLE_ADC_TOL  = 64        # 0x60006000 ADC counts (16 bit, 3.0V full scale)
+SETTLE_LLS_TOL  = 8         # NOISE Avg counts (12 bit)
+SETTLE_RELAY    = 1.0       # DIOS 768 relay change ceiling
+SETTLE_MUX      = 0.1       # SMUX ceiling
+SETTLE_GAIN     = 0.1       # SGAIN ceiling
+SETTLE_FREQ     = 0.05      # SFREQ ceiling, same gain
+SETTLE_LLS_DWELL = 0.02     # SGAIN / SFREQ change to the first NOISE, new average
+
+# sequential sampling, see adc_sample_seq
+SEQ_N_MIN       = 1         # samples before a decision, the sigma floor stands in for std
+SEQ_N_MAX       = 16        # marginal readings stop here
+SEQ_Z           = 3.0       # confidence, standard errors from the limit
+SUPPLY_SIGMA    = 8.0       # VMON noise floor, ADC counts (x4)
+PM_SIGMA        = 0.002     # U61 MUX noise floor, V
+
+# LLS gain ladder, see lls_sweep
+LLS_GAINS       = [9, 19, 29, 39, 49, 59, 69, 79, 89, 99]  # SGAIN values
+LLS_SWEEP_STEP  = 3         # coarse pass: every 3rd ladder point and both ends
+LLS_SWEEP_BEND  = 150       # Avg counts off the chord that make a bend
+
+# boot readiness after RBL and firmware download
+BOOT_READY_TIMEOUT  = 30.0  # seconds until the board is declared dead
+BOOT_READY_DELAY    = 0.2   # first retry delay, doubled on every retry
+BOOT_READY_DELAY_MAX = 2.0
+
+CMD_EOL         = '\r\n'    # cmd port line terminator used by eth_cmd_batch
+PROMPT_WAIT     = 0.5       # p_prompt_learn: wait for the VER reply
+PROMPT_QUIET    = 0.05      # p_prompt_learn: gap that ends the reply
+
+# state commands shadowed per board, see eth_cmd_state
+SHADOW_CMDS     = ['DIOS', 'SMUX', 'SGAIN', 'SFREQ', 'EN', 'STL', 'SZL']
+
+# instrumentation, see instrument_enable
+INSTR_IO        = ['eth_cmd_write', 'eth_debug_read', 'eth_debug_read_find',
+                   'r16', 'AIN_read', 'p_cmd_batch', 'debug_wait']
+INSTR_STEPS     = ['PICB_supply_voltage', 'PICB_GPIO_test', 'PICB_pressue_sensor',
+                   'PICB_LLS_chX_debug', 'PICB_LLS_test_chX', 'PICB_LLS_test_ch4']
+INSTR_BUCKETS   = [0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000]    # ms
+
+# background debug port reader, see DebugReader
+F_DEBUG_READER  = os.environ.get('PICB_DEBUG_READER', '1') == '1'
+DEBUG_RING_LINES = 4096     # lines kept per board
+DEBUG_QUIET     = 0.005     # eth_debug_read returns after this gap in the data
+DEBUG_READ_TIMEOUT = 0.05   # eth_debug_read wait for the first data
+DEBUG_WAIT_TIMEOUT = 2.0    # debug_wait / eth_debug_read_find default
+
+# queued myLog, see LogQueue
+F_LOG_QUEUE     = os.environ.get('PICB_LOG_QUEUE', '1') == '1'
+LOG_BATCH       = 256       # records written per wake-up of the log thread
+
+# test sequence checkpoint, see PICB_test_sequence
+CKPT_SUFFIX     = '_ckpt.json'      # <log_file_name>_ckpt.json in log/
+SEQ_MODES       = {'3': '', '3r': 'resume', '3f': 'failed'}     # test item -> mode
+
+# fail-fast step order from the step history of all boards, see p_steps_order
+HIST_FILE       = 'picb_history.jsonl'  # in log/, one line per step run
+HIST_TAIL       = 1 << 20   # bytes read from the end, recent boards only
+HIST_COST       = 1.0       # seconds, step without history
+HIST_COST_MIN   = 1e-3      # seconds, floor of a group's cost
+
+RESULTS_DB      = 'picb_results.db'     # in log/, see picb_results.py
+
+# firmware fast path, see p_fw_current
+FW_CACHE_FILE   = 'picb_fw_cache.json'  # in log/, image sha256 by path, size, mtime
+FLASH_FILE      = 'picb_flashed.jsonl'  # in log/, one line per flashed MCU
+FLASH_TAIL      = 1 << 20   # bytes read from the end, recently flashed MCUs
+
+# server mode, see serve() and ict_picb_client.py
+SERVE_SOCK      = 'ict_picb.sock'   # Unix socket in the station directory
+SERVE_PORT      = 50100     # 127.0.0.1 TCP port where there is no AF_UNIX
+SERVE_EXIT      = '\0exit '  # last line of a job reply: SERVE_EXIT <code>
+
+# board transcripts, see trace_enable
+TRACE_SUFFIX    = '_trace.jsonl.gz'     # in log/, <log_file_name>_<YYYYmmdd-HHMMSS>_<item>_trace...
+TRACE_IO        = ['eth_cmd_write', 'eth_debug_read', 'eth_debug_read_find',
+                   'r16', 'AIN_read', 'p_cmd_batch', 'debug_wait',
+                   'cmd_debug_verify', 'check_board_revision', 'POST']
+TRACE_LOCAL     = ['eth_ports_open', 'eth_ports_close', 'p_ports_probe']   # True in a replay
+REPLAY_ITEMS    = ['3', '4']    # test items a transcript can be replayed for
+
+
+#-------------------------------------------------------------------------------
+# Description:  PICB_* switches of one launch, read again for every job of
+#   serve() with the environment of the client. PICB_PLAN, PICB_DEBUG_READER
+#   and PICB_LOG_QUEUE take effect when the script or server starts.
+#   F_LLS_ADAPTIVE  PICB_LLS_ADAPTIVE=0   every LLS ladder point, see lls_sweep
+#   F_INSTRUMENT    PICB_INSTRUMENT=1     timing table, see instrument_enable
+#   PROFILE_STEP    PICB_PROFILE=<step>   cProfile of a step, e.g. PICB_GPIO_test
+#   F_FAIL_FAST     PICB_FAIL_FAST=1      see p_steps_order
+#   PARSE_RUN       PICB_PARSE_RUN=<n>    run parsed by test item 'parse', -1 latest
+#   ARCHIVE_COMP    PICB_ARCHIVE_COMP     log/ archive 'gz' or 'zst', see picb_log.py
+#   F_FLASH_FORCE   PICB_FLASH_FORCE=1    flash an unchanged image, see p_fw_current
+#   F_CAPTURE       PICB_CAPTURE=1        board transcript, see trace_enable
+#   REPLAY_FILE     PICB_REPLAY=<file>    transcript for test item 'replay'
+#-------------------------------------------------------------------------------
+def p_env_load():
+    global F_LLS_ADAPTIVE, F_INSTRUMENT, PROFILE_STEP, F_FAIL_FAST, PARSE_RUN
+    global ARCHIVE_COMP, F_FLASH_FORCE, F_CAPTURE, REPLAY_FILE
+
+    F_LLS_ADAPTIVE  = os.environ.get('PICB_LLS_ADAPTIVE', '1') == '1'
+    F_INSTRUMENT    = os.environ.get('PICB_INSTRUMENT', '') == '1'
+    PROFILE_STEP    = os.environ.get('PICB_PROFILE', '')
+    F_FAIL_FAST     = os.environ.get('PICB_FAIL_FAST', '') == '1'
+    PARSE_RUN       = int(os.environ.get('PICB_PARSE_RUN', '-1'))
+    ARCHIVE_COMP    = os.environ.get('PICB_ARCHIVE_COMP', 'gz')
+    F_FLASH_FORCE   = os.environ.get('PICB_FLASH_FORCE', '') == '1'
+    F_CAPTURE       = os.environ.get('PICB_CAPTURE', '') == '1'
+    REPLAY_FILE     = os.environ.get('PICB_REPLAY', '')
+
+
+p_env_load()
 
 
 picb0 = {'cmdHandle': None, 'debugHandle': None, 'ipAddr': '192.168.2.64',
@@ -56,6 +193,762 @@ picb2 = {'cmdHandle': None, 'debugHandle': None, 'ipAddr': '192.168.2.66',
         'cmdPort': 50002, 'debugPort': 50001, 'prompt': ''}
 
 
+PICB_BOARDS = [picb0, picb1, picb2]
+
+
+#-------------------------------------------------------------------------------
+# Description:  wait for an analog reading to settle
+#   polls read() until n_agree consecutive readings agree within tol, or until
+#   max_wait seconds have passed. Returns the last reading, so the caller uses
+#   the settled value instead of taking another one. With a target the
+#   polling goes on until a reading is exactly target instead, for readings
+#   that creep towards a rail (LLS open output 4095).
+# Parameter:
+#   read        function returning one reading
+#   tol         allowed difference between consecutive readings
+#   max_wait    hard ceiling in seconds (the old fixed delay)
+#   key         maps a reading to the number compared, None if not valid
+#   min_wait    dwell before the first reading, e.g. relay operate time
+#   target      value to wait for, tol and n_agree are not used
+#-------------------------------------------------------------------------------
+def settle_wait(read, tol, max_wait, key=None, min_wait=0.0, n_agree=2, target=None):
+    t_end = p_time() + max_wait
+
+    if min_wait:
+        p_sleep(min(min_wait, max_wait))
+
+    value = read()
+    last = key(value) if key else value
+    agree = 1
+
+    while (last != target) if target is not None else (agree < n_agree):
+        remaining = t_end - p_time()
+        if remaining <= 0:
+            break
+        p_sleep(min(SETTLE_POLL, remaining))
+
+        value = read()
+        this = key(value) if key else value
+        if this is not None and last is not None and abs(this - last) <= tol:
+            agree += 1
+        else:
+            agree = 1
+        last = this
+
+    return value
+
+
+#-------------------------------------------------------------------------------
+# Description:  wait until the board is back after a reboot
+#   probes the cmd and debug ports, opens them and sends VER until the
+#   expected firmware and FPGA versions come back. Retries back off from
+#   BOOT_READY_DELAY up to BOOT_READY_DELAY_MAX. The ports are left open and
+#   the banner is marked verified when the board is ready.
+# Parameter:
+#   ver         expected VER response, e.g. 'Ver ' + MCU_BL_VER + ' ' + FPGA_VER
+#   timeout     deadline in seconds
+#-------------------------------------------------------------------------------
+def eth_wait_ready(board, ver, timeout=BOOT_READY_TIMEOUT):
+    t_start = p_time()
+    delay = BOOT_READY_DELAY
+
+    while p_time() - t_start < timeout:
+        if p_ports_probe(board):
+            try:
+                rtn = temp = ''
+                if p_ports_open(board):
+                    rtn = eth_cmd_write(board, 'VER')
+                    temp = eth_debug_read(board)
+            except (socket.error, socket.timeout):
+                pass    # the board went down again, close and retry
+            if parse_ver(str(rtn) + str(temp)) == parse_ver(ver):
+                myLog('board ready after {:.1f}s'.format(p_time() - t_start), 's')
+                board.setdefault('proven', set()).add(ver)
+                return True
+            p_ports_close(board)
+
+        p_sleep(delay)
+        delay = min(delay * 2, BOOT_READY_DELAY_MAX)
+
+    myLog('board not ready after {}s, expected {}'.format(timeout, ver), 'F')
+    return False
+
+
+#-------------------------------------------------------------------------------
+# Description:  send several commands in one socket write
+#   the replies are split on the board prompt and returned in command order,
+#   one round-trip for the whole list instead of one per command. The prompt
+#   is board['prompt'], learned by p_ports_open when not configured. Without
+#   a prompt to split on the commands are sent one by one with eth_cmd_write.
+# Parameter:
+#   cmds        list of commands, e.g. ['STL 1 1 1 0 1 1 1 0', 'DIOG 0']
+#-------------------------------------------------------------------------------
+def eth_cmd_batch(board, cmds):
+    # state commands the board already has are answered from the shadow
+    shadow = dict(board.setdefault('shadow', {}))
+    rtn_all = [None] * len(cmds)
+    send = []
+    same = {}       # repeated state command -> index of the one sent
+    for i, cmd in enumerate(cmds):
+        key, value = p_shadow_key(cmd)
+        if key is not None and key in shadow and shadow[key][0] == value:
+            if shadow[key][1] is None:
+                same[i] = shadow[key][2]
+            else:
+                rtn_all[i] = shadow[key][1]
+        else:
+            send.append(i)
+            if key == 'EN':
+                shadow.pop('SGAIN', None)
+                shadow.pop('SFREQ', None)
+            if key is not None:
+                shadow[key] = (value, None, i)
+
+    rtn = p_cmd_batch(board, [cmds[i] for i in send])
+    for i, r in zip(send, rtn):
+        rtn_all[i] = r
+        p_shadow_update(board, cmds[i], r)
+    for i, j in same.items():
+        rtn_all[i] = rtn_all[j]
+
+    return rtn_all
+
+
+def p_cmd_batch(board, cmds):
+    prompt = board['prompt']
+    handle = board['cmdHandle']
+
+    if not cmds:
+        return []
+
+    if not prompt or not hasattr(handle, 'sendall'):
+        return [eth_cmd_write(board, cmd) for cmd in cmds]
+
+    buf = ''
+    try:
+        handle.sendall((CMD_EOL.join(cmds) + CMD_EOL).encode())
+        while buf.count(prompt) < len(cmds):
+            data = handle.recv(4096)
+            if not data:
+                break
+            buf += data.decode('ascii', 'replace')
+    except (socket.error, socket.timeout):
+        pass
+
+    n = min(buf.count(prompt), len(cmds))
+    rtn = buf.split(prompt)[:n]
+    if n < len(cmds):
+        myLog('batch reply incomplete: ' + ' | '.join(cmds), 'F')
+        rtn += [''] * (len(cmds) - n)
+
+    return rtn
+
+
+#-------------------------------------------------------------------------------
+# Description:  write a state command only if it changes the board state
+#   board['shadow'] holds the last value written for each of SHADOW_CMDS
+#   (DIOS per pin) together with its reply. A write that would not change
+#   anything is skipped and returns the cached reply. A failed write clears
+#   the shadow, so does opening the ports and a reboot.
+# Parameter:
+#   cmd         e.g. 'DIOS 768 0', 'SGAIN 39 80', 'EN 2'
+#-------------------------------------------------------------------------------
+def eth_cmd_state(board, cmd):
+    shadow = board.setdefault('shadow', {})
+    key, value = p_shadow_key(cmd)
+
+    if key is not None and key in shadow and shadow[key][0] == value:
+        return shadow[key][1]
+
+    rtn = eth_cmd_write(board, cmd)
+    p_shadow_update(board, cmd, rtn)
+
+    return rtn
+
+
+def p_shadow_key(cmd):
+    word = cmd.split()
+    if not word or word[0] not in SHADOW_CMDS:
+        return (None, None)
+
+    if word[0] == 'DIOS':
+        return (' '.join(word[:2]), ' '.join(word[2:]))
+
+    return (word[0], ' '.join(word[1:]))
+
+
+def p_shadow_update(board, cmd, rtn):
+    shadow = board.setdefault('shadow', {})
+    key, value = p_shadow_key(cmd)
+
+    if not rtn:
+        shadow.clear()
+    elif key is not None:
+        if key == 'EN' and shadow.get(key, (None,))[0] != value:
+            # gain and frequency are not assumed to follow a new channel
+            shadow.pop('SGAIN', None)
+            shadow.pop('SFREQ', None)
+        shadow[key] = (value, rtn)
+
+
+#-------------------------------------------------------------------------------
+# Description:  background debug port reader
+#   one thread per board drains the debug socket into a ring buffer of the
+#   last DEBUG_RING_LINES lines, so the board never blocks on debug output.
+#   Readers keep a cursor into the buffer: read() returns everything new,
+#   wait() returns as soon as a line matching the pattern arrives.
+#
+#   While a reader runs it is the only consumer of the socket, so
+#   eth_debug_read and eth_debug_read_find are replaced here and in my_ict
+#   (cmd_debug_verify uses them) by versions reading the ring buffer. Boards
+#   without a reader still go to the my_ict functions.
+#-------------------------------------------------------------------------------
+class DebugReader(object):
+
+    def __init__(self, handle):
+        self.handle = handle
+        self.lines = collections.deque(maxlen=DEBUG_RING_LINES)
+        self.seq = 0            # sequence number of the next line
+        self.cursor = 0         # first line not yet returned to the caller
+        self.partial = ''
+        self.t_data = 0.0
+        self.cond = threading.Condition()
+        self.f_run = True
+        self.thread = threading.Thread(target=self.p_run, name='debug_reader')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def p_run(self):
+        self.handle.settimeout(0.1)
+        while self.f_run:
+            try:
+                data = self.handle.recv(4096)
+            except socket.timeout:
+                continue
+            except socket.error:
+                break
+            if not data:
+                break
+
+            text = self.partial + data.decode('ascii', 'replace')
+            parts = text.split('\n')
+            with self.cond:
+                self.partial = parts.pop()
+                for line in parts:
+                    self.lines.append((self.seq, line + '\n'))
+                    self.seq += 1
+                self.t_data = time.time()
+                self.cond.notify_all()
+
+        with self.cond:
+            self.f_run = False
+            self.cond.notify_all()
+
+    def stop(self):
+        self.f_run = False
+        self.thread.join(1.0)
+
+    # forget everything received so far
+    def drain(self):
+        with self.cond:
+            self.cursor = self.seq
+            self.partial = ''
+
+    # lines from the cursor on, oldest first
+    def p_new_lines(self):
+        if self.lines and self.lines[0][0] > self.cursor:
+            self.cursor = self.lines[0][0]     # overrun, lines were dropped
+        return [line for seq, line in self.lines if seq >= self.cursor]
+
+    def read(self, quiet=DEBUG_QUIET, timeout=DEBUG_READ_TIMEOUT):
+        t_end = time.time() + timeout
+        with self.cond:
+            while self.seq == self.cursor and not self.partial and self.f_run:
+                remaining = t_end - time.time()
+                if remaining <= 0:
+                    break
+                self.cond.wait(remaining)
+            while self.f_run and time.time() - self.t_data < quiet:
+                self.cond.wait(quiet)
+
+            text = ''.join(self.p_new_lines()) + self.partial
+            self.cursor = self.seq
+            self.partial = ''
+
+        return text
+
+    # text up to and including the first new line matching regex, None if
+    # nothing matched before the timeout
+    def wait(self, regex, timeout=DEBUG_WAIT_TIMEOUT):
+        t_end = time.time() + timeout
+        with self.cond:
+            while True:
+                lines = self.p_new_lines()
+                for i, line in enumerate(lines):
+                    if regex.search(line):
+                        self.cursor += i + 1
+                        return ''.join(lines[:i + 1])
+
+                self.cursor += len(lines)
+                remaining = t_end - time.time()
+                if remaining <= 0 or not self.f_run:
+                    return None
+                self.cond.wait(remaining)
+
+
+def debug_reader_start(board):
+    debug_reader_stop(board)
+    if hasattr(board['debugHandle'], 'recv'):
+        board['debugReader'] = DebugReader(board['debugHandle'])
+
+
+def debug_reader_stop(board):
+    reader = board.pop('debugReader', None)
+    if reader is not None:
+        reader.stop()
+
+
+#-------------------------------------------------------------------------------
+# Description:  wait for a debug line matching pattern
+#   returns the debug text up to and including the matching line, '' if it
+#   did not show up within timeout. Without a reader the debug port is read
+#   once with eth_debug_read.
+#-------------------------------------------------------------------------------
+def debug_wait(board, pattern, timeout=DEBUG_WAIT_TIMEOUT):
+    reader = board.get('debugReader')
+    if reader is None:
+        return eth_debug_read(board)
+
+    return reader.wait(re.compile(pattern), timeout) or ''
+
+
+def p_debug_read(board):
+    reader = board.get('debugReader')
+    if reader is None:
+        return ICT_DEBUG_READ(board)
+
+    return reader.read()
+
+
+def p_debug_read_find(board, pattern):
+    reader = board.get('debugReader')
+    if reader is None:
+        return ICT_DEBUG_READ_FIND(board, pattern)
+
+    return re.findall(pattern, reader.wait(re.compile(pattern)) or '')
+
+
+ICT_DEBUG_READ = my_ict.eth_debug_read
+ICT_DEBUG_READ_FIND = my_ict.eth_debug_read_find
+if F_DEBUG_READER:
+    my_ict.eth_debug_read = eth_debug_read = p_debug_read
+    my_ict.eth_debug_read_find = eth_debug_read_find = p_debug_read_find
+
+
+#-------------------------------------------------------------------------------
+# Description:  queued myLog
+#   myLog (in this script and in my_ict) puts the record on a queue and
+#   returns; a background thread writes the records in order, up to LOG_BATCH
+#   per wake-up, through the original my_ict myLog. Levels are passed on
+#   unchanged. A record goes to the sink bound to the calling thread
+#   (board['log_sink'], bound by p_ports_open) or to myLog.
+#   log_flush() waits until everything queued is written; it runs at exit,
+#   also after sys.exit(), uncaught exceptions and SIGTERM / SIGBREAK (the
+#   harness killing a hung test), and before the log file is parsed.
+#-------------------------------------------------------------------------------
+class LogQueue(object):
+
+    def __init__(self, write):
+        self.write = write
+        self.queue = queue.Queue()
+        self.local = threading.local()
+        self.thread = threading.Thread(target=self.p_run, name='log_queue')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def p_run(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < LOG_BATCH:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            for write, args in batch:
+                try:
+                    write(*args)
+                except Exception as e:
+                    sys.stderr.write('log write failed: ' + str(e) + '\n')
+                self.queue.task_done()
+
+    def bind(self, sink):
+        self.local.sink = sink
+
+    def log(self, *args):
+        self.queue.put((getattr(self.local, 'sink', None) or self.write, args))
+
+    # console output in the order of the log records
+    def echo(self, *args):
+        self.queue.put((print, args))
+
+    def flush(self):
+        self.queue.join()
+
+
+def log_bind(board):
+    if LOG is not None:
+        LOG.bind(board.get('log_sink'))
+
+
+def log_print(*args):
+    if LOG is None:
+        print(*args)
+    else:
+        LOG.echo(*args)
+
+
+def log_flush():
+    if LOG is not None:
+        LOG.flush()
+
+
+ICT_MYLOG = my_ict.myLog
+LOG = None
+if F_LOG_QUEUE:
+    LOG = LogQueue(ICT_MYLOG)
+    my_ict.myLog = myLog = LOG.log
+    atexit.register(log_flush)
+
+
+# termination signal -> SystemExit, so finally blocks and the atexit
+# handlers run; flushing from the handler could deadlock on the queue
+f_terminated = False
+
+
+def p_sig_exit(signum, frame):
+    global f_terminated
+    f_terminated = True
+    sys.exit(128 + signum)
+
+
+for sig_name in ['SIGTERM', 'SIGBREAK']:    # SIGBREAK: Ctrl+Break / console closed on Windows
+    if hasattr(signal, sig_name):
+        signal.signal(getattr(signal, sig_name), p_sig_exit)
+
+
+# TCP connect to both ports without going through my_ict
+def p_ports_probe(board):
+    try:
+        for port in [board['cmdPort'], board['debugPort']]:
+            s = socket.create_connection((board['ipAddr'], port), timeout=0.5)
+            s.close()
+    except (socket.error, socket.timeout):
+        return False
+
+    return True
+
+
+# deliberate delays, kept apart from I/O waits by the instrumentation
+def p_sleep(sec):
+    if REPLAY is not None:
+        REPLAY.sleep(sec)
+        return
+    time.sleep(sec)
+
+
+# clock of the settle and boot deadlines, the transcript clock in a replay
+def p_time():
+    if REPLAY is not None:
+        return REPLAY.clock
+    return time.time()
+
+
+def p_adc_read(board):
+    return r16(board, 0x60006000)
+
+
+#-------------------------------------------------------------------------------
+# Description:  bulk ADC acquisition
+#   the samples are taken back-to-back with nothing else in between and
+#   returned as numpy arrays, one row per sample. my_ict has no multi-channel
+#   read, so every sample is still one AIN_read / r16. adc_stats() works on
+#   all columns at once, adc_sample_seq() reads through these.
+# Parameter:
+#   chs         AIN channels, one column each
+#   n           samples per channel / register
+#-------------------------------------------------------------------------------
+def AIN_read_bulk(board, chs, n=1):
+    np = p_numpy(board)
+    return np.array([[AIN_read(board, ch) for ch in chs] for i in range(n)], dtype=float)
+
+
+def r16_bulk(board, addr, n=1):
+    np = p_numpy(board)
+    return np.array([r16(board, addr) for i in range(n)], dtype=float)
+
+
+# mean, standard deviation and in-limit flag per column, one row per sample
+def adc_stats(samples, lo, hi):
+    np = p_numpy(None)
+    samples = np.atleast_2d(samples)
+    mean = samples.mean(axis=0)
+    std = samples.std(axis=0, ddof=1) if len(samples) > 1 else np.zeros_like(mean)
+    in_lim = (mean >= np.minimum(lo, hi)) & (mean <= np.maximum(lo, hi))
+
+    return (mean, std, in_lim)
+
+
+#-------------------------------------------------------------------------------
+# Description:  sequential early-stop sampling against a limit window
+#   samples every undecided column until its mean is inside or outside
+#   [lo, hi] by SEQ_Z standard errors, or SEQ_N_MAX samples were taken. The
+#   standard error uses the larger of the sample deviation and sigma, so two
+#   readings far from a limit are enough while marginal ones get more.
+#   Returns mean, std, sample count and in-limit flag per column.
+# Parameter:
+#   read        read(cols, n) returns n new rows for the columns cols, e.g.
+#               through AIN_read_bulk; the first call reads n_min rows
+#   lo, hi      limit window per column
+#   sigma       noise floor, scalar or per column
+#   seed        readings already taken, e.g. the settled one of settle_wait,
+#               one row per sample; they count as the first samples
+#-------------------------------------------------------------------------------
+def adc_sample_seq(read, lo, hi, sigma, n_min=SEQ_N_MIN, n_max=SEQ_N_MAX, seed=None):
+    np = p_numpy(None)
+    lo, hi = np.minimum(lo, hi), np.maximum(lo, hi)
+    sigma = np.broadcast_to(np.asarray(sigma, dtype=float), lo.shape)
+    samples = [[] for i in range(len(lo))]
+    active = list(range(len(lo)))
+
+    rows = [] if seed is None else np.atleast_2d(seed)
+    burst = max(n_min - len(rows), 0)
+    while active:
+        if burst:
+            rows = list(rows) + list(np.atleast_2d(read(active, burst)))
+        for row in rows:
+            for i, val in zip(active, row):
+                samples[i].append(val)
+        rows, burst = [], 1
+
+        n = len(samples[active[0]])
+        mean, std, in_lim = adc_stats(np.array([samples[i] for i in active]).T,
+                                      lo[active], hi[active])
+        se = np.maximum(std, sigma[active]) / np.sqrt(n)
+        inside = (mean - SEQ_Z*se >= lo[active]) & (mean + SEQ_Z*se <= hi[active])
+        outside = (mean + SEQ_Z*se < lo[active]) | (mean - SEQ_Z*se > hi[active])
+        done = inside | outside | (n >= n_max)
+        active = [i for i, d in zip(active, done) if not d]
+
+    mean = np.array([np.mean(s) for s in samples])
+    std = np.array([np.std(s, ddof=1) if len(s) > 1 else 0.0 for s in samples])
+    cnt = np.array([len(s) for s in samples])
+    in_lim = (mean >= lo) & (mean <= hi)
+
+    return (mean, std, cnt, in_lim)
+
+
+def p_numpy(board):
+    try:
+        import numpy
+    except ImportError:
+        myLog('Import numpy Error', 'F')
+        if board is not None:
+            p_ports_close(board)
+        sys.exit("""numpy library is missing\n
+                    run pip install numpy in DOS""")
+
+    return numpy
+
+
+def p_lls_noise(board):
+    eth_cmd_write(board, 'NOISE')
+    return parse_noise(debug_wait(board, r'Avg \d+ Max'))
+
+
+#-------------------------------------------------------------------------------
+# Description:  NOISE reading once the LLS Avg has settled after a gain or
+#               relay change, returns the parsed LlsNoise record
+#-------------------------------------------------------------------------------
+def p_lls_settled(board, max_wait, min_wait=SETTLE_LLS_DWELL, target=None):
+    return settle_wait(lambda: p_lls_noise(board), SETTLE_LLS_TOL, max_wait,
+                       key=lambda r: r.avg, min_wait=min_wait, target=target)
+
+
+#-------------------------------------------------------------------------------
+# Description:  measurement rows of a board, see picb_results.py
+#   the store is created on first use; rows are written by p_results_flush
+#   after every sequence step and when the ports are closed
+#-------------------------------------------------------------------------------
+def p_results(board):
+    if board.get('results') is None:
+        board['results'] = ResultStore(RESULTS_DB, {
+            'run': sys.argv[2] + ' ' + time.strftime('%Y-%m-%d %H:%M:%S') +
+                   (' replay' if REPLAY is not None else ''),
+            'board': sys.argv[2], 'ip': board['ipAddr'], 'script_ver': SCRIPT_VER})
+    return board['results']
+
+
+def p_results_flush(board, f_close=False):
+    store = board.get('results')
+    if store is not None and f_close:
+        store.close()
+    elif store is not None:
+        store.flush()
+
+
+# one LLS reading, result from the given avg (lo, hi) and noise_max limits
+def p_lls_store(board, test, rec, lo=None, hi=None, noise_max=None, **fields):
+    result = None
+    if lo is not None or hi is not None or noise_max is not None:
+        result = (rec.avg is not None
+                  and (lo is None or rec.avg >= lo) and (hi is None or rec.avg <= hi)
+                  and (noise_max is None or (rec.noise is not None and rec.noise <= noise_max)))
+    p_results(board).add(test, noise=rec.noise, avg=rec.avg, lo=lo, hi=hi,
+                         noise_max=noise_max, result=result, **fields)
+
+
+#-------------------------------------------------------------------------------
+# Description:  adaptive sweep over the ladder points 0 .. n-1
+#   read(i)     measures point i, returns the Avg of every curve read there
+#   sat         Avg where the output saturates
+#   The coarse pass reads every step-th point and both ends. An interval is
+#   halved while its ends do not rise, it crosses sat or the middle point
+#   of its neighbourhood is more than bend counts off the chord. Returns the
+#   indices read, ascending.
+#-------------------------------------------------------------------------------
+def lls_sweep(read, n, sat, step=LLS_SWEEP_STEP, bend=LLS_SWEEP_BEND):
+    ys = {}
+    todo = sorted(set(range(0, n, step)) | set([n - 1]))
+    while todo:
+        for i in todo:
+            ys[i] = read(i)
+
+        idx = sorted(ys)
+        split = set()
+        for a, b in zip(idx, idx[1:]):
+            if p_sweep_split(ys[a], ys[b], sat):
+                split.add((a, b))
+        for a, b, c in zip(idx, idx[1:], idx[2:]):
+            if p_sweep_bend(ys[a], ys[b], ys[c], (b - a) / float(c - a), bend):
+                split.update([(a, b), (b, c)])
+
+        todo = sorted(set((a + b) // 2 for a, b in split if b - a > 1))
+
+    return sorted(ys)
+
+
+def p_sweep_split(ya, yb, sat):
+    return any(a is not None and b is not None and (a > b or a < sat <= b)
+               for a, b in zip(ya, yb))
+
+
+def p_sweep_bend(ya, yb, yc, t, bend):
+    return any(a is not None and b is not None and c is not None
+               and abs(a + (c - a)*t - b) > bend
+               for a, b, c in zip(ya, yb, yc))
+
+
+#-------------------------------------------------------------------------------
+# Description:  limit checks of one LLS ladder, recs {index: LlsNoise}
+#   the first / last point are checked against first_max / last_min, the
+#   points below saturation must rise and every noise must be in limit
+#-------------------------------------------------------------------------------
+def lls_ladder_check(np, recs, first_max, last_min, label):
+    f_pass = True
+    lim = PICB_PLAN['limits']
+    idx = sorted(recs)
+
+    if any(recs[i].noise is None for i in idx):
+        myLog('LLS Noise value not found', 'F')
+        f_pass = False
+    if any(recs[i].avg is None for i in idx):
+        myLog('LLS Avg value not found', 'F')
+        f_pass = False
+
+    myLog(label[0]+''.join(str(recs[i].noise)+', ' for i in idx if recs[i].noise is not None), 's')
+    myLog(label[1]+''.join(str(recs[i].avg)+', ' for i in idx if recs[i].avg is not None), 's')
+
+    avg = np.array([np.nan if recs[i].avg is None else recs[i].avg for i in idx], dtype=float)
+    noise = np.array([np.nan if recs[i].noise is None else recs[i].noise for i in idx], dtype=float)
+
+    if avg[0] > first_max:
+        myLog('avg[0] is out of spec '+str(recs[idx[0]].avg)+' '+str(first_max), 'F')
+        f_pass = False
+
+    if avg[-1] < last_min:
+        myLog('avg['+str(idx[-1])+'] is out of spec '+str(recs[idx[-1]].avg)+' '+str(last_min), 'F')
+        f_pass = False
+
+    # when output not saturates output should increase with increasing input
+    for k in np.nonzero((avg[1:] < lim['lls_saturation']) & (avg[:-1] > avg[1:]))[0]:
+        myLog('Output did NOT increase with incresing gain', 'F')
+        myLog('step '+str(idx[k])+' '+str(recs[idx[k]].avg)+' '+str(recs[idx[k+1]].avg), 'F')
+        f_pass = False
+
+    for k in np.nonzero(noise > lim['lls_noise_max'])[0]:
+        myLog('Noise exceed limit '+ str(recs[idx[k]].noise), 'F')
+        f_pass = False
+
+    return f_pass
+
+
+#-------------------------------------------------------------------------------
+# Description:  LLS gain ladder of the enabled channel at the frequencies freqs
+#   sgain(g)    -> (gain_in, gain_out) for ladder value g
+#   Every frequency is read at a gain point before the next SGAIN, starting
+#   with the one still set, so a gain change settles once for all of them.
+#   Reads LLS_GAINS through lls_sweep, or every point without F_LLS_ADAPTIVE,
+#   and returns {freq: lls_ladder_check} of the readings.
+#-------------------------------------------------------------------------------
+def p_lls_ladder(board, ch, freqs, sgain, last_min, label):
+    lim = PICB_PLAN['limits']
+    np = p_numpy(board)
+    n = len(LLS_GAINS)
+    recs = dict((freq, {}) for freq in freqs)
+    order = list(freqs)
+
+    def p_read(i):
+        gain_in, gain_out = sgain(LLS_GAINS[i])
+        # SGAIN <in> <out>  Set Gains
+        eth_cmd_state(board, 'SGAIN '+str(gain_in)+' '+str(gain_out))
+        for k, freq in enumerate(order):
+            eth_cmd_state(board, 'SFREQ '+str(freq))
+            rec = p_lls_settled(board, SETTLE_FREQ if k else SETTLE_GAIN)
+            p_lls_store(board, 'lls', rec, ch=ch, freq=freq, gain_in=gain_in, gain_out=gain_out,
+                        lo=last_min if i == n - 1 else None,
+                        hi=lim['lls_avg_first_max'] if i == 0 else None,
+                        noise_max=lim['lls_noise_max'])
+            recs[freq][i] = rec
+        order.reverse()
+        return [recs[freq][i].avg for freq in freqs]
+
+    if F_LLS_ADAPTIVE:
+        lls_sweep(p_read, n, lim['lls_saturation'])
+    else:
+        for i in range(n):
+            p_read(i)
+
+    result = {}
+    for freq in freqs:
+        myLog('LLS CH '+str(ch)+' - '+str(freq), 's')
+        result[freq] = lls_ladder_check(np, recs[freq], lim['lls_avg_first_max'], last_min, label)
+
+    return result
+
+
+# lls_freq of a PICB_LLS_test_* -> frequency list
+def p_lls_freqs(lls_freq):
+    return list(lls_freq) if isinstance(lls_freq, (list, tuple)) else [lls_freq]
+
+
+# per frequency pass -> return value, {freq: pass} for a frequency list
+def p_lls_result(lls_freq, f_pass):
+    if isinstance(lls_freq, (list, tuple)):
+        return f_pass
+    return f_pass[lls_freq]
+
+
 #-------------------------------------------------------------------------------
 # Description:
 # Parameter:
@@ -66,31 +959,37 @@ def PICB_supply_voltage(board):
 
     myLog('Supply voltage analog input test started', 's')
 
-    ch      = [0, 1, 2, 3, 4, 5, 6]
-    name    = ['VMON_12V_MINUS', 'VMON_5V', 'VMON_DDS_LO', 'VMON_DDS_HI', 'VMON_12V', 'VMON_3_3V', 'VMON_PM_BIAS']
-    volt    = [-12, 5, 1, 1, 12, 3.3, 1]
-    scale    = [ (-2.05/10)*DAC_PER_VOLT12,
-                1.0/2*DAC_PER_VOLT12,
-                DAC_PER_VOLT12,
-                DAC_PER_VOLT12,
-                1.37/(1.37+5.23)*DAC_PER_VOLT12,
-                3.57/(3.57+1.15)*DAC_PER_VOLT12,
-                3.0*(1+(23.2+0.133)/10)*102/(102+309)*DAC_PER_VOLT12
-                ]
-
-    for i, val in enumerate(ch):
-        # see firmware cb_ain.c file line 420. data = ain_int_chan[ain_chnl].raw >> 2;
-        adc_val = AIN_read(board, val)*4
-
-        if not (i==2 or i==3):  # VMON_DDS_LO and VMON_DDS_HI no checking
-            if adc_val > volt[i]*scale[i]*1.10 or adc_val < volt[i]*scale[i]*0.90:
+    supply  = PICB_PLAN['supply']
+    tol     = PICB_PLAN['limits']['supply_tol']
+    ch      = [s['ch'] for s in supply]
+
+    np = p_numpy(board)
+    typ = np.array([s['typ'] for s in supply])
+    lo, hi = typ*(1.0 - tol), typ*(1.0 + tol)
+    for i, s in enumerate(supply):
+        if not s['check']:  # VMON_DDS_LO and VMON_DDS_HI no checking
+            lo[i], hi[i] = -np.inf, np.inf
+
+    # see firmware cb_ain.c file line 420. data = ain_int_chan[ain_chnl].raw >> 2;
+    adc_val, adc_std, cnt, in_lim = adc_sample_seq(
+        lambda cols, n: AIN_read_bulk(board, [ch[i] for i in cols], n)*4, lo, hi, SUPPLY_SIGMA)
+
+    for i, s in enumerate(supply):
+        if s['check']:
+            msg = 'CH{} expected: {} measured: {:.1f} (std {:.1f}, {} samples)'.format(
+                i, int(typ[i]), adc_val[i], adc_std[i], cnt[i])
+            if not in_lim[i]:
                 f_pass = False
-                myLog('CH{} expected: {} measured: {}'.format(i, int(volt[i] * scale[i]), adc_val), 'F')
+                myLog(msg, 'F')
             else:
-                myLog('CH{} expected: {} measured: {}'.format(i, int(volt[i] * scale[i]), adc_val), 's')
+                myLog(msg, 's')
+
+        val_meas = adc_val[i] / s['scale']
+        myLog('CH ' + s['name'] + ' voltage: ' + str(val_meas) + 'V', 's')
 
-        val_meas = adc_val / scale[i]
-        myLog('CH ' + name[i] + ' voltage: ' + str(val_meas) + 'V', 's')
+        p_results(board).add('supply', name=s['name'], ch=s['ch'], adc=adc_val[i], volt=val_meas,
+                             lo=lo[i] if s['check'] else None, hi=hi[i] if s['check'] else None,
+                             result=in_lim[i] if s['check'] else None)
 
 
     if f_pass:
@@ -117,30 +1016,30 @@ def PICB_pressue_sensor(board):
 
     myLog('PM sensor input test started', 's')
 
-    FACTOR_FIXTURE_HW = 0.96    # compensate for actual resistor on fixture
+    pm = PICB_PLAN['pm']    # fixture_factor compensates for actual resistor on fixture
 
     # with relay open
-    pm_r = 0.008 * FACTOR_FIXTURE_HW  # 8 ohm
-    eth_cmd_write(board, 'DIOS 768 0')    # LLS output un-grounded
+    pm_r = pm['r_open'] * pm['fixture_factor']    # 8 ohm
+    eth_cmd_state(board, 'DIOS 768 0')    # LLS output un-grounded
     eth_debug_read(board)
-    time.sleep(1)
+    p_pm_relay_settle(board)
     if f_pass:
-        f_pass, pm_measure1 = p_pressue_sensor(pm_r)
+        f_pass, pm_measure1 = p_pressue_sensor(board, pm_r)
 
     # with relay close
-    pm_r = 0.004 * FACTOR_FIXTURE_HW  # 4 ohm
-    eth_cmd_write(board, 'DIOS 768 1')    # LLS output grounded
+    pm_r = pm['r_closed'] * pm['fixture_factor']  # 4 ohm
+    eth_cmd_state(board, 'DIOS 768 1')    # LLS output grounded
     eth_debug_read(board)
-    time.sleep(1)
+    p_pm_relay_settle(board)
     if f_pass:
-        f_pass, pm_measure2 = p_pressue_sensor(pm_r)
+        f_pass, pm_measure2 = p_pressue_sensor(board, pm_r)
 
     # PM reading should be smaller with relay closed
     for i in [0, 1]:
         if pm_measure1[i] < pm_measure2[i]:
             f_pass = False
 
-    eth_cmd_write(board, 'DIOS 768 0')  # LLS output un-grounded
+    eth_cmd_state(board, 'DIOS 768 0')  # LLS output un-grounded
 
     if f_pass:
         myLog('PM sensor input test finished', 'P')
@@ -150,8 +1049,18 @@ def PICB_pressue_sensor(board):
     return f_pass
 
 
-def p_pressue_sensor(r_sense):
-    pm_bias_volt = 3.0 * ((23.2+0.133)/10.0 + 1.0)
+# after a relay change wait on PM_VAC_IN, the highest gain path settles last
+def p_pm_relay_settle(board):
+    eth_cmd_state(board, 'SMUX 1')
+    eth_debug_read(board)
+    settle_wait(lambda: p_adc_read(board), SETTLE_ADC_TOL, SETTLE_RELAY,
+                min_wait=0.05)
+
+
+# expected U61 MUX input voltages for a sense resistor, computed once per value
+@functools.lru_cache(maxsize=None)
+def pm_expected(r_sense):
+    pm_bias_volt = PICB_PLAN['consts']['PM_BIAS_VOLT']
     pm_in_p = pm_bias_volt * (3.3 + r_sense) / (3.3 + r_sense +3.3)
     pm_in_n = pm_bias_volt * (3.3 / (3.3 + r_sense +3.3))
     pm_sensor = pm_in_p - pm_in_n
@@ -161,36 +1070,49 @@ def p_pressue_sensor(r_sense):
     pm_in = pm_sensor*gain_u55 + 3.0*332.0/(332.0+1000.0) # offset R324 and R330
     pm_vac_in = pm_sensor*gain_u55*gain_u56 + 1.50 # offset by U53
 
-    #          0.864,     2.572          0.748                   1.5
-    u61_mux = ['PM_IN',  'PM_VAC_IN',    'A2D_REF3.0V',          '1_5VOLT_BIAS']
-    val_typ = [pm_in,     pm_vac_in,     3.0*332/(1000+332),     3.0*2.32/(2.32+2.32)]
-    val_min = [pm_in*0.9, pm_vac_in*0.9, 3.0*332/(1000+332)*0.9, 3.0*2.32/(2.32+2.32)*0.9]
-    val_max = [pm_in*1.1, pm_vac_in*1.1, 3.0*332/(1000+332)*1.1, 3.0*2.32/(2.32+2.32)*1.1]
+    #       0.864, 2.572      0.748               1.5
+    return (pm_in, pm_vac_in, 3.0*332/(1000+332), 3.0*2.32/(2.32+2.32))
+
 
-    pm_measure = []
+def p_pressue_sensor(board, r_sense):
+    tol = PICB_PLAN['limits']['pm_tol']
+
+    u61_mux = ['PM_IN',  'PM_VAC_IN',    'A2D_REF3.0V',          '1_5VOLT_BIAS']
+    val_typ = pm_expected(r_sense)
+    val_min = [v * (1.0 - tol) for v in val_typ]
+    val_max = [v * (1.0 + tol) for v in val_typ]
 
     # U61 mux input: PM_VAC_IN
+    adc_volt, volt_std, cnt, in_lim = [], [], [], []
     for idx, val in enumerate(u61_mux):
-        eth_cmd_write(board, 'SMUX ' + str(idx)) # select MUX (U61) input
+        eth_cmd_state(board, 'SMUX ' + str(idx)) # select MUX (U61) input
         eth_debug_read(board)
 
-        time.sleep(0.1)
-        adc_cnt = r16(board, 0x60006000)
-        adc_volt = 3.0 * adc_cnt / pow(2, 16)
-        myLog(val+' reading: '+str(adc_cnt)+' (ADC) '+str(adc_volt)+'V', 'd')
+        settled = settle_wait(lambda: p_adc_read(board), SETTLE_ADC_TOL, SETTLE_MUX)
+        result = adc_sample_seq(lambda cols, n: 3.0 * r16_bulk(board, 0x60006000, n)[:, None] / pow(2, 16),
+                                [val_min[idx]], [val_max[idx]], PM_SIGMA,
+                                seed=[[3.0 * settled / pow(2, 16)]])
+        for lst, item in zip([adc_volt, volt_std, cnt, in_lim], result):
+            lst.append(item[0])
 
-        if adc_volt < val_min[idx]:
-            myLog(u61_mux[idx]+' expected >'+str(val_min[idx])+' got '+str(adc_volt), 'F')
-            f_pass = False
-        elif adc_volt > val_max[idx]:
-            myLog(u61_mux[idx]+' expected <'+str(val_max[idx])+' got '+str(adc_volt), 'F')
-            f_pass = False
+    adc_cnt = [v * pow(2, 16) / 3.0 for v in adc_volt]
+
+    for idx, val in enumerate(u61_mux):
+        myLog(val+' reading: '+str(adc_cnt[idx])+' (ADC) '+str(adc_volt[idx])+'V std '+str(volt_std[idx])+'V, '+str(cnt[idx])+' samples', 'd')
+
+        if adc_volt[idx] < val_min[idx]:
+            myLog(u61_mux[idx]+' expected >'+str(val_min[idx])+' got '+str(adc_volt[idx]), 'F')
+        elif adc_volt[idx] > val_max[idx]:
+            myLog(u61_mux[idx]+' expected <'+str(val_max[idx])+' got '+str(adc_volt[idx]), 'F')
         else:
-            myLog(u61_mux[idx] + ' expected: ' + str(val_typ[idx]) + ' got ' + str(adc_volt), 's')
-            f_pass = True
+            myLog(u61_mux[idx] + ' expected: ' + str(val_typ[idx]) + ' got ' + str(adc_volt[idx]), 's')
+
+        p_results(board).add('pm', name=val, cond='r_sense ' + str(r_sense), ch=idx,
+                             adc=adc_cnt[idx], volt=adc_volt[idx], lo=val_min[idx],
+                             hi=val_max[idx], result=in_lim[idx])
 
-        if idx==0 or idx==1:
-            pm_measure.append(adc_cnt)
+    f_pass = all(in_lim)
+    pm_measure = adc_cnt[0:2]
 
     return (f_pass, pm_measure)
 
@@ -200,73 +1122,87 @@ def p_pressue_sensor(r_sense):
 #
 # Parameter:
 #-------------------------------------------------------------------------------
-def PICB_LLS_chX_debug(board, ch=0, lls_freq=100, f_plot=False):
+def PICB_LLS_chX_debug(board, ch=0, lls_freq=100, f_plot=False, f_adaptive=True):
     """
-    PICB_LLS_chX_debug(ch=0, lls_freq=100, f_plot=False)
+    PICB_LLS_chX_debug(ch=0, lls_freq=100, f_plot=False, f_adaptive=True)
     """
     f_pass  = True
+    lim     = PICB_PLAN['limits']
+    n       = len(LLS_GAINS)
 
     myLog('LLS CH '+str(ch)+' debug test started', 's')
 
-    eth_cmd_write(board, 'SFREQ '+str(lls_freq))
-    eth_cmd_write(board, 'EN '+ str(ch))
+    eth_cmd_state(board, 'SFREQ '+str(lls_freq))
+    eth_cmd_state(board, 'EN '+ str(ch))
 
-    noise_s = ''
-    avg_s = ''
-    noise_i = []
-    avg_i = []
     #----------------------------------------------------
     # test gain linearity
-    # input gain
-    for gout in range(0, 10):
-        print('\n', gout, ' out of 9    ')
-        for gin in range(0, 10):
-            print(gout*10 + gin)
-
-            gain_in = str(gin*10+9)
-            gain_out = str(gout*10 + 9)
-
-            eth_cmd_write(board, 'SGAIN '+gain_in+' '+gain_out)
-            time.sleep(0.1)
-            eth_cmd_write(board, 'NOISE')
-            temp = eth_debug_read(board)
-
-            n = re.findall('LLS Noise \d+ Min', temp)[0][10:-4]
-            noise_s = noise_s + n + ', '
-            noise_i.append(int(n))
-
-            a = re.findall(' Avg \d+ Max', temp)[0][5:-4]
-            avg_s = avg_s + a + ', '
-            avg_i.append(int(a))
-
-            temp1 = re.findall('Avg \d* Max', temp)
-            if len(temp1) != 1:
-                myLog(temp, 'F')
+    # input gain, a row per output gain; with f_adaptive both run through
+    # lls_sweep, the rows refined on the Avg at their first and last point
+    grid = {}
+    def p_row(gout):
+        log_print('\n', gout, ' out of 9    ')
+        row = grid.setdefault(gout, {})
+
+        def p_point(gin):
+            log_print(gout*10 + gin)
+            eth_cmd_state(board, 'SGAIN '+str(LLS_GAINS[gin])+' '+str(LLS_GAINS[gout]))
+            rec = p_lls_settled(board, SETTLE_GAIN)
+            p_lls_store(board, 'lls_debug', rec, ch=ch, freq=lls_freq,
+                        gain_in=LLS_GAINS[gin], gain_out=LLS_GAINS[gout])
+            row[gin] = rec
+            return [rec.avg]
+
+        if f_adaptive:
+            lls_sweep(p_point, n, lim['lls_saturation'])
+        else:
+            for gin in range(n):
+                p_point(gin)
+        return [row[0].avg, row[n-1].avg]
+
+    if f_adaptive:
+        lls_sweep(p_row, n, lim['lls_saturation'])
+    else:
+        for gout in range(n):
+            p_row(gout)
+
+    # a row per output gain of (gain_in, value), the adaptive sweep leaves
+    # out points and rows, so every value keeps its gains
+    noise_i = {}
+    avg_i = {}
+    for gout in sorted(grid):
+        for gin in sorted(grid[gout]):
+            rec = grid[gout][gin]
+            if rec.noise is None or rec.avg is None:
+                myLog('LLS Noise/Avg value not found '+str(rec), 'F')
                 f_pass = False
+                continue
 
-    myLog('LLS noise:   ', 's')
-    myLog(noise_s, 'v')
-    myLog('', 's')
+            noise_i.setdefault(LLS_GAINS[gout], []).append((LLS_GAINS[gin], rec.noise))
+            avg_i.setdefault(LLS_GAINS[gout], []).append((LLS_GAINS[gin], rec.avg))
 
-    myLog('LLS average: ', 's')
-    myLog(avg_s, 'v')
-    myLog('', 's')
+    for title, rows in [('LLS noise:   ', noise_i), ('LLS average: ', avg_i)]:
+        myLog(title + '(gain_out: gain_in=value)', 's')
+        for gout in sorted(rows):
+            myLog(str(gout) + ': ' + ', '.join(str(gin) + '=' + str(v) for gin, v in rows[gout]), 'v')
+        myLog('', 's')
 
-    # write average and noise date to .csv file for plotting and analysing
-    with open(sys.argv[2] + '_LLS.csv', 'a+') as f:
-        f.write('CH'+str(ch)+' LLS_value, '+avg_s+'\n')
-        f.write('CH'+str(ch)+' LLS_noise, '+noise_s+'\n')
+    # average and noise are in the results store (test 'lls_debug') for
+    # plotting and analysing: python picb_results.py <db> --test lls_debug
+    p_results_flush(board)
 
     if f_plot == True:
         try:
             from matplotlib import pyplot as pl
 
-            pl.subplot(211)
-            pl.title('LLS Average ')
-            pl.plot(avg_i)
-            pl.subplot(212)
-            pl.title('noise')
-            pl.plot(noise_i)
+            for i, (title, rows) in enumerate([('LLS Average ', avg_i), ('noise', noise_i)]):
+                pl.subplot(211 + i)
+                pl.title(title)
+                for gout in sorted(rows):
+                    pl.plot([p[0] for p in rows[gout]], [p[1] for p in rows[gout]],
+                            marker='.', label='gain_out '+str(gout))
+                pl.xlabel('gain_in')
+                pl.legend(fontsize='small')
             pl.suptitle('LLS test - CH\n'+str(ch))
             pl.show()
         except ImportError:
@@ -288,76 +1224,37 @@ def PICB_LLS_chX_debug(board, ch=0, lls_freq=100, f_plot=False):
 #
 #-------------------------------------------------------------------------------
 def PICB_LLS_test_chX(board, ch=0, lls_freq=100):
-    f_pass  = True
+    """
+    PICB_LLS_test_chX(ch=0, lls_freq=100)
+    lls_freq is one frequency or a list, read in one pass; a list returns
+    {freq: pass}
+    """
+    lim     = PICB_PLAN['limits']
+    freqs   = p_lls_freqs(lls_freq)
 
-    myLog('LLS CH '+str(ch)+' input linearity test started - '+str(lls_freq), 's')
+    myLog('LLS CH '+str(ch)+' input linearity test started - '+', '.join(str(f) for f in freqs), 's')
 
-    eth_cmd_write(board, 'DIOS 768 0')  # LLS output un-grounded
+    eth_cmd_state(board, 'DIOS 768 0')  # LLS output un-grounded
 
-    eth_cmd_write(board, 'SFREQ '+str(lls_freq))
-    eth_cmd_write(board, 'EN '+ str(ch))
+    eth_cmd_state(board, 'SFREQ '+str(freqs[0]))
+    eth_cmd_state(board, 'EN '+ str(ch))
     eth_debug_read(board)
 
     #----------------------------------------------------
     # test gain linearity - input gain
-    for idx_g, gain_out in enumerate([80]):
-        avg_i = []
-        noise_i = []
-        avg_s = ''
-        noise_s = ''
-        for i in range(0, 10): # 1 ... 9
-            gain = i*10 + 9
-            # SGAIN <in> <out>  Set Gains
-            eth_cmd_write(board, 'SGAIN '+str(gain)+' '+str(gain_out))
-            time.sleep(0.1)
-            eth_cmd_write(board, 'NOISE')
-            temp = eth_debug_read(board)
-
-            if len(re.findall('LLS Noise \d+ Min', temp)) == 1:
-                n = re.findall('LLS Noise \d+ Min', temp)[0][10:-4]
-                noise_s = noise_s + n + ', '
-                noise_i.append(int(n))
-            else:
-                myLog('LLS Noise value not found', 'F')
-                f_pass = False
-
-            if len(re.findall('Avg \d+ Max', temp)) == 1:
-                a = re.findall(' Avg \d+ Max', temp)[0][5:-4]
-                avg_s = avg_s + a + ', '
-                avg_i.append(int(a))
-            else:
-                myLog('LLS Avg value not found', 'F')
-                f_pass = False
-
-        myLog('CH '+str(ch)+', SGAIN X '+str(gain_out)+', LLS_noise,  '+noise_s, 's')
-        myLog('CH '+str(ch)+', SGAIN X '+str(gain_out)+', LLS_averag, '+avg_s, 's')
-
-        if avg_i[0] > 1500:
-            myLog('avg[0] is out of spec '+str(avg_i[0])+' 1200', 'F')
-            f_pass = False
-
-        if avg_i[9] < 3000:
-            myLog('avg[0] is out of spec '+str(avg_i[9])+' 3000', 'F')
-            f_pass = False
-
-        for idx in range(0, 9):
-            # when output not saturates output should increase with increasing input
-            if (avg_i[idx+1]<4000) and (avg_i[idx]>avg_i[idx+1]):
-                myLog('Output did NOT increase with incresing gain', 'F')
-                myLog('step '+str(idx)+' '+str(avg_i[idx])+' '+str(avg_i[idx+1]), 'F')
-                f_pass = False
-
-        for idx, item in enumerate(noise_i):
-            if item > LLS_NOISE_LIMIT:
-                myLog('Noise exceed limit '+ str(item), 'F')
-                f_pass = False
-
-    if f_pass:
-        myLog('LLS CH '+str(ch)+' test finished', 'P')
-    else:
-        myLog('LLS CH '+str(ch)+' test finished', 'F')
+    gain_out = 80
+    f_pass = p_lls_ladder(board, ch, freqs, lambda gain: (gain, gain_out),
+                          lim['lls_avg_last_min'],
+                          ('CH '+str(ch)+', SGAIN X '+str(gain_out)+', LLS_noise,  ',
+                           'CH '+str(ch)+', SGAIN X '+str(gain_out)+', LLS_averag, '))
+
+    for freq in freqs:
+        if f_pass[freq]:
+            myLog('LLS CH '+str(ch)+' test finished - '+str(freq), 'P')
+        else:
+            myLog('LLS CH '+str(ch)+' test finished - '+str(freq), 'F')
 
-    return f_pass
+    return p_lls_result(lls_freq, f_pass)
 
 
 #-------------------------------------------------------------------------------
@@ -367,17 +1264,20 @@ def PICB_LLS_test_chX(board, ch=0, lls_freq=100):
 def PICB_LLS_test_ch4(board, lls_freq=100):
     """
     PICB_LLS_test_ch4(lls_freq=100)
+    lls_freq is one frequency or a list, read in one pass; a list returns
+    {freq: pass}
     """
-    f_pass  = True
+    lim     = PICB_PLAN['limits']
+    freqs   = p_lls_freqs(lls_freq)
 
-    myLog('LLS CH 4 test started - '+str(lls_freq), 's')
+    myLog('LLS CH 4 test started - '+', '.join(str(f) for f in freqs), 's')
 
-    eth_cmd_write(board, 'DIOS 768 0')  # LLS output un-grounded
+    eth_cmd_state(board, 'DIOS 768 0')  # LLS output un-grounded
 
-    eth_cmd_write(board, 'EN 4')
+    eth_cmd_state(board, 'EN 4')
 
     for freq in [90, 120, 105]:
-        eth_cmd_write(board, 'SFREQ '+str(freq))
+        eth_cmd_state(board, 'SFREQ '+str(freq))
         eth_cmd_write(board, 'GFREQ ')
         eth_debug_read_find(board, 'LLS GET Freq '+str(freq))
 
@@ -386,93 +1286,60 @@ def PICB_LLS_test_ch4(board, lls_freq=100):
         eth_cmd_write(board, 'GPHASE ')
         eth_debug_read_find(board, 'LLS GET Phase '+str(freq))
 
-    eth_cmd_write(board, 'SFREQ '+str(lls_freq))
+    eth_cmd_state(board, 'SFREQ '+str(freqs[0]))
 
     #----------------------------------------------------
     # test gain linearity - output gain
     myLog('Testing LLS gain linearity - output gain', 's')
-    avg_i = []
-    noise_i = []
-    avg_s = ''
-    noise_s = ''
-    for i in range(0, 10):
-        gain = i*10 + 9
-        eth_cmd_write(board, 'SGAIN 30 '+str(gain)) # SGAIN <in> <out>
-        time.sleep(0.1)
-        eth_cmd_write(board, 'NOISE')
-        temp = eth_debug_read(board)
-
-        if len(re.findall('LLS Noise \d+ Min', temp)) == 1:
-            t = re.findall('LLS Noise \d+ Min', temp)[0][10:-4]
-            noise_i.append(int(t))
-            noise_s = noise_s + t + ', '
-        else:
-            myLog('LLS Noise value not found', 'F')
-            f_pass = False
-
-        if len(re.findall('Avg \d+ Max', temp)) == 1:
-            t = re.findall('Avg \d+ Max', temp)[0][4:-4]
-            avg_i.append(int(t))
-            avg_s = avg_s + t + ', '
-        else:
-            myLog('LLS Avg value not found', 'F')
-            f_pass = False
-
-    myLog('CH 4, '+'SGAIN 30 X, LLS_noise,   '+noise_s, 's')
-    myLog('CH 4, '+'SGAIN 30 X, LLS_average, '+avg_s, 's')
-
-    if avg_i[0] > 1500:
-        myLog('avg[0] is out of spec '+str(avg_i[0])+' 1200', 'F')
-        f_pass = False
-
-    if avg_i[9] < 3500:
-        myLog('avg[0] is out of spec '+str(avg_i[9])+' 3600', 'F')
-        f_pass = False
-
-    for idx in range(0, 9):
-        # when output not saturates output should increase with increasing input
-        if (avg_i[idx+1]<4000) and (avg_i[idx]>avg_i[idx+1]):
-            myLog('Output did NOT increase with incresing gain', 'F')
-            myLog('step '+str(idx)+' '+str(avg_i[idx])+' '+str(avg_i[idx+1]), 'F')
-            f_pass = False
-
-    # check noise value
-    for idx, item in enumerate(noise_i):
-        if item > LLS_NOISE_LIMIT:
-            myLog('Noise exceed limit '+ str(item), 'F')
-            f_pass = False
+    f_pass = p_lls_ladder(board, 4, freqs, lambda gain: (30, gain),   # SGAIN <in> <out>
+                          lim['lls_ch4_avg_last_min'],
+                          ('CH 4, '+'SGAIN 30 X, LLS_noise,   ', 'CH 4, '+'SGAIN 30 X, LLS_average, '))
 
     #----------------------------------------------------
     # LLS output grounded during calibration
     myLog('Testing LLS otuput short to ground', 's')
-    eth_cmd_write(board, 'SGAIN 99 99')
+    # every frequency is read in each relay state, the relay settles once
+    eth_cmd_state(board, 'SGAIN 99 99')
+    order = list(freqs)
     for i in range (0, 3):
-        eth_cmd_write(board, 'DIOS 768 1') # LLS output grounded
-        time.sleep(1)
-        eth_cmd_write(board, 'NOISE')
-        temp = eth_debug_read(board)
-        if len(re.findall('Avg \d+ Max', temp)) == 1:
-            t = re.findall('Avg \d+ Max', temp)[0][4:-4]
-            if int(t) > 640:
-                myLog('LLS output grounded, expected < 640', 'F')
-                f_pass = False
+        eth_cmd_state(board, 'DIOS 768 1') # LLS output grounded
+        for k, freq in enumerate(order):
+            eth_cmd_state(board, 'SFREQ '+str(freq))
+            if k:
+                rec = p_lls_settled(board, SETTLE_FREQ)
+            else:
+                rec = p_lls_settled(board, SETTLE_RELAY, min_wait=0.05)
+            p_lls_store(board, 'lls_ground', rec, ch=4, freq=freq, gain_in=99, gain_out=99,
+                        cond='grounded', hi=lim['lls_grounded_max'])
+            if rec.avg is not None:
+                if rec.avg > lim['lls_grounded_max']:
+                    myLog('LLS output grounded, expected < '+str(lim['lls_grounded_max'])+' - '+str(freq), 'F')
+                    f_pass[freq] = False
+            else:
+                myLog('LLS Avg value not found', 'F')
+                f_pass[freq] = False
+        order.reverse()
+
+        eth_cmd_state(board, 'DIOS 768 0') # LLS output not grounded
+        for k, freq in enumerate(order):
+            eth_cmd_state(board, 'SFREQ '+str(freq))
+            # the output creeps up to the rail, wait for lls_open itself
+            rec = p_lls_settled(board, SETTLE_RELAY, min_wait=SETTLE_LLS_DWELL if k else 0.05,
+                                target=lim['lls_open'])
+            p_lls_store(board, 'lls_ground', rec, ch=4, freq=freq, gain_in=99, gain_out=99,
+                        cond='open', lo=lim['lls_open'], hi=lim['lls_open'])
+            if rec.avg != lim['lls_open']:
+                myLog('LLS output not grounded, expected '+str(lim['lls_open'])+' - '+str(freq), 'F')
+                f_pass[freq] = False
+        order.reverse()
+
+    for freq in freqs:
+        if f_pass[freq]:
+            myLog('LLS CH 4 test finished - '+str(freq), 'P')
         else:
-            myLog('LLS Avg value not found', 'F')
-            f_pass = False
-
-        eth_cmd_write(board, 'DIOS 768 0') # LLS output not grounded
-        time.sleep(1)
-        eth_cmd_write(board, 'NOISE')
-        if eth_debug_read_find(board, 'Avg 4095 Max') == []:
-            myLog('LLS output not grounded, expected 4095', 'F')
-            f_pass = False
-
-    if f_pass:
-        myLog('LLS CH 4 test finished', 'P')
-    else:
-        myLog('LLS CH 4 test finished', 'F')
+            myLog('LLS CH 4 test finished - '+str(freq), 'F')
 
-    return f_pass
+    return p_lls_result(lls_freq, f_pass)
 
 
 
@@ -501,12 +1368,11 @@ def PICB_GPIO_test(board):
 
     for loop in range(0, 10):
         for i, e in enumerate(gpio_out):
-            eth_cmd_write(board, 'DIOS 768 ' + e)
+            eth_cmd_state(board, 'DIOS 768 ' + e)
             rtn = eth_cmd_write(board, 'DIOG 4')
             eth_debug_read(board)
 
-            temp = re.findall('Bit 4 Value \d', rtn)
-            if not (len(temp)==1 and temp[0][-1]==gpio_in[i]):
+            if parse_diog(rtn).get(4) != int(gpio_in[i]):
                 f_pass = False
                 myLog('DIOS 768 ' + e, 's')
                 myLog('DIOG 4 expected ' + gpio_in[i], 'F')
@@ -517,8 +1383,7 @@ def PICB_GPIO_test(board):
 
     myLog('Opto-coupler outputs and GPIO input 0 test started', 's')
     # the command below de-activates all Opto-coupler outputs (pulled HIGH)
-    eth_cmd_write(board, 'SZL 1 1 1 1 1 1 1 1 1 1')
-    eth_cmd_write(board, 'STL 1 1 1 1 1 1 1 1')
+    eth_cmd_batch(board, ['SZL 1 1 1 1 1 1 1 1 1 1', 'STL 1 1 1 1 1 1 1 1'])
     eth_debug_read(board)
 
     # STL   LLS_POSITIVE            LLS_NEGATIVE
@@ -533,19 +1398,18 @@ def PICB_GPIO_test(board):
 
 
     for loop_no in range(0, 10):
-        for i, cmd in enumerate(cmds):
-            eth_cmd_write(board, cmd)
-            rtn = eth_cmd_write(board, 'DIOG 0')
-            eth_debug_read(board)
+        # one round-trip per loop: <cmd> DIOG 0 <cmd> DIOG 0 ...
+        rtn_all = eth_cmd_batch(board, [c for cmd in cmds for c in (cmd, 'DIOG 0')])
+        eth_debug_read(board)
 
-            temp = re.findall('Bit 0 Value \d', rtn)
-            if not (len(temp) == 1 and temp[0][-1] == gpio_in[i]):
+        for i, cmd in enumerate(cmds):
+            rtn = rtn_all[2*i + 1]
+            if parse_diog(rtn).get(0) != int(gpio_in[i]):
                 f_pass = False
                 myLog(cmd + ' DIOG 0 expected ' + gpio_in[i], 'F')
 
     # the command below de-activates all Opto-coupler outputs (pulled HIGH)
-    eth_cmd_write(board, 'SZL 1 1 1 1 1 1 1 1 1 1')
-    eth_cmd_write(board, 'STL 1 1 1 1 1 1 1 1')
+    eth_cmd_batch(board, ['SZL 1 1 1 1 1 1 1 1 1 1', 'STL 1 1 1 1 1 1 1 1'])
     eth_debug_read(board)
 
     # SZL   LLS_POSITIVE            LLS_NEGATIVE
@@ -560,13 +1424,13 @@ def PICB_GPIO_test(board):
     gpio_in = [ '1', '0', '1', '0']
 
     for loop_no in range(0, 10):
-        for i, cmd in enumerate(cmds):
-            eth_cmd_write(board, cmd)
-            rtn = eth_cmd_write(board, 'DIOG 0')
-            eth_debug_read(board)
+        # one round-trip per loop: <cmd> DIOG 0 <cmd> DIOG 0 ...
+        rtn_all = eth_cmd_batch(board, [c for cmd in cmds for c in (cmd, 'DIOG 0')])
+        eth_debug_read(board)
 
-            temp = re.findall('Bit 0 Value \d', rtn)
-            if not (len(temp) == 1 and temp[0][-1] == gpio_in[i]):
+        for i, cmd in enumerate(cmds):
+            rtn = rtn_all[2*i + 1]
+            if parse_diog(rtn).get(0) != int(gpio_in[i]):
                 f_pass = False
                 myLog(cmd + ' DIOG 0 expected ' + gpio_in[i], 'F')
 
@@ -581,7 +1445,7 @@ def PICB_GPIO_test(board):
                 rtn = eth_cmd_write(board, 'DIOG ' + e)
                 eth_debug_read(board)
 
-                if re.findall('Bit ' + e + ' Value 1', rtn) != []:
+                if parse_diog(rtn).get(int(e)) == 1:
                     #myLog('toggling HIGH seen at GPIO ' + e + ' ' + str(k), 's')
                     break
                 if k == 99:
@@ -592,7 +1456,7 @@ def PICB_GPIO_test(board):
                 rtn = eth_cmd_write(board, 'DIOG ' + e)
                 eth_debug_read(board)
 
-                if re.findall('Bit ' + e + ' Value 0', rtn) != []:
+                if parse_diog(rtn).get(int(e)) == 0:
                     #myLog('toggling LOW seen at GPIO ' + e + ' ' + str(k), 's')
                     break
                 if k == 99:
@@ -608,96 +1472,436 @@ def PICB_GPIO_test(board):
 
 
 
+#-------------------------------------------------------------------------------
+# Description:  test plan, compiled once at start-up
+#   PICB_STEPS holds (name, function, arguments, group, level) in dependency
+#   level order. The name is the checkpoint key, the function is looked up by
+#   name when the step runs so instrument_enable() wrappers are used. Steps of
+#   one group share the fixture state (EN channel, DIOS 768 relay) and are
+#   never split by p_steps_order. Fixtures listed in the plan are added to
+#   PICB_BOARDS.
+#-------------------------------------------------------------------------------
+def p_plan_load(path):
+    try:
+        return plan_compile(path, [n for n in globals() if n.startswith('PICB_')])
+    except (IOError, ValueError, KeyError) as e:
+        sys.exit('test plan ' + path + ': ' + str(e))
+
+
+PICB_PLAN = p_plan_load(PLAN_FILE)
+PICB_STEPS = PICB_PLAN['steps']
+PICB_BOARDS += [b for b in PICB_PLAN['boards']
+                if b['ipAddr'] not in [p['ipAddr'] for p in PICB_BOARDS]]
+
+
+#-------------------------------------------------------------------------------
+# Description:  checkpoint file per board serial (log file name)
+#   {'script_ver': .., 'plan': sha256, 'steps': {name: {'pass': bool, ..}}},
+#   written after every step. A checkpoint of another script version or test
+#   plan is ignored.
+#-------------------------------------------------------------------------------
+def p_ckpt_file():
+    return sys.argv[2] + CKPT_SUFFIX
+
+
+def p_ckpt_load():
+    try:
+        with open(p_ckpt_file()) as f:
+            ckpt = json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+    if ckpt.get('script_ver') != SCRIPT_VER:
+        myLog('checkpoint of ' + str(ckpt.get('script_ver')) + ' ignored', 's')
+        return {}
+
+    if ckpt.get('plan') != PICB_PLAN['sha256']:
+        myLog('checkpoint of another test plan ignored', 's')
+        return {}
+
+    return ckpt.get('steps', {})
+
+
+def p_ckpt_save(steps):
+    if REPLAY is not None:      # a re-grade leaves the board's checkpoint alone
+        return
+    path = p_ckpt_file()
+    tmp = path + '.' + str(os.getpid())
+    with open(tmp, 'w') as f:
+        json.dump({'script_ver': SCRIPT_VER, 'plan': PICB_PLAN['sha256'], 'steps': steps},
+                  f, indent=1, sort_keys=True)
+    os.replace(tmp, path)
+
+
+
+#-------------------------------------------------------------------------------
+# Description:  step history shared by all boards and fixtures
+#   HIST_FILE gets one JSON line per step run, appended so parallel fixtures
+#   do not overwrite each other. Only the last HIST_TAIL bytes are read back,
+#   {name: {'runs': n, 'fails': n, 'time': seconds}}.
+#-------------------------------------------------------------------------------
+def p_hist_load():
+    hist = {}
+    try:
+        with open(HIST_FILE, 'rb') as f:
+            f.seek(0, 2)
+            size = f.tell()
+            f.seek(max(0, size - HIST_TAIL))
+            lines = f.read().splitlines()
+    except IOError:
+        return hist
+
+    if size > HIST_TAIL:
+        lines = lines[1:]   # cut in the middle of a line
+
+    for line in lines:
+        try:
+            rec = json.loads(line.decode())
+            h = hist.setdefault(rec['step'], {'runs': 0, 'fails': 0, 'time': 0.0})
+        except (ValueError, KeyError):
+            continue
+        h['runs'] += 1
+        h['fails'] += 0 if rec.get('pass') else 1
+        h['time'] += rec.get('time', 0.0)
+
+    return hist
+
+
+def p_hist_add(name, status, dt):
+    if REPLAY is not None:
+        return
+    with open(HIST_FILE, 'a') as f:
+        f.write(json.dumps({'step': name, 'pass': bool(status), 'time': round(dt, 3)}) + '\n')
+
+
+#-------------------------------------------------------------------------------
+# Description:  fail-fast order, most likely failure per second first
+#   dependency levels run in order, inside a level a group scores
+#   P(any step fails) / sum of the mean step times, with
+#   P(fail) = (fails+1)/(runs+2) so a step without history counts as 50%.
+#   Groups of equal score and the steps inside a group keep the plan order.
+#-------------------------------------------------------------------------------
+def p_steps_order(steps, hist):
+    groups = collections.OrderedDict()
+    for step in steps:
+        groups.setdefault((step[4], step[3]), []).append(step)
+
+    def p_score(group):
+        p_pass = 1.0
+        cost = 0.0
+        for step in group:
+            h = hist.get(step[0], {'runs': 0, 'fails': 0, 'time': 0.0})
+            p_pass *= 1.0 - (h['fails'] + 1.0) / (h['runs'] + 2.0)
+            cost += h['time'] / h['runs'] if h['runs'] else HIST_COST
+        return (1.0 - p_pass) / max(cost, HIST_COST_MIN)
+
+    order = sorted(groups.values(), key=lambda g: (g[0][4], -p_score(g)))
+    return [step for group in order for step in group]
+
+
+
 #-------------------------------------------------------------------------------
 # Description:
-# Parameter:
-#
+# Parameter:    mode    ''       all steps, new checkpoint
+#                       'resume' steps without a checkpoint result, after a
+#                                crash or reboot
+#                       'failed' steps without a checkpoint PASS (rework)
+#   returns PASS only if every step has passed, in this run or before
+#   PICB_FAIL_FAST=1 stops at the first failure and runs the steps in
+#   p_steps_order, otherwise all steps run in table order
 #-------------------------------------------------------------------------------
-def PICB_test_sequence(board):
+def PICB_test_sequence(board, mode=''):
     status = True
-    f_skip_check = True
+    f_skip_check = not F_FAIL_FAST
 
     print('starting test sequence')
+    instrument_reset()
+
+    steps = p_ckpt_load() if mode else {}
+    if not mode:
+        p_ckpt_save(steps)
+
+    order = PICB_STEPS
+    if F_FAIL_FAST:
+        order = p_steps_order(PICB_STEPS, p_hist_load())
+        myLog('step order: ' + ', '.join(step[0] for step in order), 's')
+
+    for name, func, args, group, level in order:
+        rec = steps.get(name)
+        if rec is not None and (mode == 'resume' or (mode == 'failed' and rec['pass'])):
+            myLog(name + ' skipped - checkpoint ' + ('PASS' if rec['pass'] else 'FAIL'), 's')
+            status = rec['pass']
+            continue
+
+        if status or f_skip_check:
+            t0 = time.perf_counter()
+            status = globals()[func](board, *args)
+            sub = None
+            if isinstance(status, dict):    # multi-frequency LLS, {freq: pass}
+                sub = dict((str(k), bool(v)) for k, v in status.items())
+                status = all(sub.values())
+            if mode != 'failed':    # rework reruns would skew the history
+                p_hist_add(name, status, time.perf_counter() - t0)
+            steps[name] = {'pass': bool(status), 'time': time.strftime('%Y-%m-%d %H:%M:%S')}
+            if sub:
+                steps[name]['sub'] = sub
+            p_ckpt_save(steps)
+            p_results_flush(board)
+
+    instrument_report()
+
+    return all(steps.get(step[0], {}).get('pass') for step in PICB_STEPS)
+
+
+#-------------------------------------------------------------------------------
+# Description:  port handling and verification state shared by the parts
+#   board['f_open'] tracks whether the ports are open, so a part started from
+#   main_all reuses the connection of the previous part. board['proven'] holds
+#   the checks already passed in this process; a reboot drops the version
+#   checks and the state shadow but keeps the board identity.
+#-------------------------------------------------------------------------------
+def p_ports_open(board):
+    if board.get('f_open'):
+        return True
+
+    log_bind(board)
+    board['f_open'] = bool(eth_ports_open(board))
+    board['shadow'] = {}
+    if board['f_open'] and F_DEBUG_READER:
+        debug_reader_start(board)
+    if board['f_open'] and not board.get('prompt'):
+        board['prompt'] = p_prompt_learn(board)
+    return board['f_open']
+
+
+# cmd port prompt from the tail of a raw VER reply, '' if there is none
+def p_prompt_learn(board):
+    handle = board['cmdHandle']
+    if not hasattr(handle, 'sendall'):
+        return ''
+
+    buf = ''
+    timeout = handle.gettimeout()
+    try:
+        handle.sendall(('VER' + CMD_EOL).encode())
+        handle.settimeout(PROMPT_WAIT)
+        while True:
+            data = handle.recv(4096)
+            if not data:
+                break
+            buf += data.decode('ascii', 'replace')
+            handle.settimeout(PROMPT_QUIET)     # more only while it keeps coming
+    except socket.error:
+        pass
+    finally:
+        handle.settimeout(timeout)
+    eth_debug_read(board)   # VER text on the debug port
+
+    prompt = buf.replace('\r', '\n').split('\n')[-1]
+    if parse_ver(buf) is None or not prompt.strip():
+        return ''
+    myLog('cmd prompt ' + repr(prompt), 'd')
+    return prompt
+
+
+def p_ports_close(board):
+    debug_reader_stop(board)
+    p_results_flush(board, f_close=True)
+    if board.get('f_open'):
+        eth_ports_close(board)
+    board['f_open'] = False
+
+
+def p_board_rebooted(board):
+    board['shadow'] = {}
+    proven = board.setdefault('proven', set())
+    for key in [k for k in proven if k.startswith('Ver ')]:
+        proven.discard(key)
+
+
+def p_verify_once(board, key, check, *args):
+    proven = board.setdefault('proven', set())
+    if key in proven:
+        myLog(key + ' already verified', 's')
+        return True
+
+    status = check(board, *args)
+    if status:
+        proven.add(key)
+
+    return status
+
+
+def p_board_identity(board):
+    status = True
+
+    if status:
+        # BDID returns rotary switch position in TOCB app FW
+        # BDID returns 0 in TOCB bootloader
+        status = p_verify_once(board, 'BDID', cmd_debug_verify, 'BDID', 'Board ID ' + ROTARY_SW)
+    if status:
+        status = p_verify_once(board, 'BDT', cmd_debug_verify, 'BDT', 'IA')
+    if status:
+        status = p_verify_once(board, 'REV', check_board_revision, BOARD_REVISION)
+    if status:
+        status = p_verify_once(board, 'MCUID', cmd_debug_verify, 'MCUID', 'MCU ID 0x451, Rev 0x1001, SERNUM')
+    if status:
+        # faults can show up at any time, always checked
+        status = cmd_debug_verify(board, 'DGC', '0, 0, 0, 0, 0, 0, 0 No Faults #0')
 
-    if status or f_skip_check:
-        status = PICB_supply_voltage(board)
-
-    if status or f_skip_check:
-        status = PICB_GPIO_test(board)
-
-    if status or f_skip_check:
-        status = PICB_pressue_sensor(board)
-
-    if status or f_skip_check:
-        status = PICB_LLS_test_chX(board, 0, 100)  # J14 loopback CH0 of U66
-    if status or f_skip_check:
-        status = PICB_LLS_test_chX(board, 0, 105)
-    if status or f_skip_check:
-        status = PICB_LLS_test_chX(board, 1, 100)  # J15 loopback CH1 of U66
-    if status or f_skip_check:
-        status = PICB_LLS_test_chX(board, 1, 105)
-    if status or f_skip_check:
-        status = PICB_LLS_test_chX(board, 2, 100)  # J16 loopback CH2 of U66
-    if status or f_skip_check:
-        status = PICB_LLS_test_chX(board, 2, 105)
-    if status or f_skip_check:
-        status = PICB_LLS_test_chX(board, 3, 100)  # J17 loopback CH3 of U66
-    if status or f_skip_check:
-        status = PICB_LLS_test_chX(board, 3, 105)
-
-    if status or f_skip_check:
-        status = PICB_LLS_test_ch4(board, 100)  # on-board loopback CH4 of U66
-    if status or f_skip_check:
-        status = PICB_LLS_test_ch4(board, 105)
-
-    if status or f_skip_check:
-        status = PICB_LLS_test_chX(board, 5, 100)  # J18 loopback CH5 of U66
-    if status or f_skip_check:
-        status = PICB_LLS_test_chX(board, 5, 105)
-    
     return status
 
 
+#-------------------------------------------------------------------------------
+# Description:  firmware image hash and flash records
+#   fw_image() hashes the image through a read-only memory map once per
+#   process; FW_CACHE_FILE keeps the hash for the next launches until the
+#   file size or mtime changes. After a successful download the MCU serial
+#   (MCUID SERNUM) and the image hash go into FLASH_FILE. p_fw_current() is
+#   True when the board runs MCU_FW_VER and its MCU was last flashed with
+#   this image, then main_p1 skips RBL and main_p2 the download.
+#   PICB_FLASH_FORCE=1 always flashes.
+#-------------------------------------------------------------------------------
+def fw_image(bin_file):
+    path = os.path.abspath(bin_file)
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+
+    return p_fw_hash(path, st.st_size, st.st_mtime)
+
+
+@functools.lru_cache(maxsize=None)
+def p_fw_hash(path, size, mtime):
+    try:
+        with open(FW_CACHE_FILE) as f:
+            cache = json.load(f)
+    except (IOError, ValueError):
+        cache = {}
+
+    rec = cache.get(path)
+    if rec and rec['size'] == size and rec['mtime'] == mtime:
+        return rec['sha256']
+
+    try:
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            sha = hashlib.sha256(mm).hexdigest()
+    except (IOError, ValueError):
+        return None     # unreadable or empty image, always flashed
+
+    cache[path] = {'size': size, 'mtime': mtime, 'sha256': sha}
+    tmp = FW_CACHE_FILE + '.' + str(os.getpid())
+    with open(tmp, 'w') as f:
+        json.dump(cache, f, indent=1, sort_keys=True)
+    os.replace(tmp, FW_CACHE_FILE)
+
+    return sha
+
+
+def p_flash_record(mcu):
+    try:
+        with open(FLASH_FILE, 'rb') as f:
+            f.seek(0, 2)
+            f.seek(max(0, f.tell() - FLASH_TAIL))
+            lines = f.read().splitlines()
+    except IOError:
+        return None
+
+    for line in reversed(lines):
+        try:
+            rec = json.loads(line.decode())
+        except ValueError:
+            continue
+        if rec.get('mcu') == mcu:
+            return rec
+
+    return None
+
+
+def p_flash_add(board, bin_file):
+    mcu = p_mcu_serial(board)
+    sha = fw_image(bin_file)
+    if mcu is None or sha is None:
+        return
+
+    with open(FLASH_FILE, 'a') as f:
+        f.write(json.dumps({'mcu': mcu, 'image': os.path.basename(bin_file), 'sha256': sha,
+                            'ver': MCU_FW_VER, 'time': time.strftime('%Y-%m-%d %H:%M:%S')}) + '\n')
+
+
+# reply and debug text of one command, without pass/fail logging
+def p_board_query(board, cmd):
+    rtn = eth_cmd_write(board, cmd)
+    return str(rtn) + str(eth_debug_read(board))
+
+
+def p_mcu_serial(board):
+    return parse_mcu_serial(p_board_query(board, 'MCUID'))
+
+
+def p_fw_current(board, bin_file):
+    if F_FLASH_FORCE:
+        return False
+
+    sha = fw_image(bin_file)
+    if sha is None:
+        return False
+    if parse_ver(p_board_query(board, 'VER')) != BoardVer(MCU_FW_VER, FPGA_VER):
+        return False
+
+    mcu = p_mcu_serial(board)
+    rec = p_flash_record(mcu) if mcu else None
+    if rec is None or rec['sha256'] != sha:
+        return False
+
+    myLog(MCU_FW_VER + ' image ' + sha[:12] + ' already on MCU ' + mcu + ' (' + rec['time'] + ')', 's')
+    return True
+
+
+
 #-------------------------------------------------------------------------------
 # Description:
 # Parameter:
 #-------------------------------------------------------------------------------
 def main_p1(board):
     status = True
+    ver_fw = 'Ver ' + MCU_FW_VER + ' ' + FPGA_VER
+    ver_bl = 'Ver ' + MCU_BL_VER + ' ' + FPGA_VER
 
     myLog('\n' + myTime(2), 'h')
     myLog('===============================================================================', 'h')
     myLog(SCRIPT_VER, 's')
     myLog(sys.argv[0]+' '+sys.argv[1]+' '+sys.argv[2]+' '+sys.argv[3], 's')
 
-    if not eth_ports_open(board):
-        sys.exit()
+    if not p_ports_open(board):
+        sys.exit(1)
 
     if status:
-        status = cmd_debug_verify(board, 'VER', 'Ver ' + MCU_FW_VER + ' ' + FPGA_VER)
+        status = p_verify_once(board, ver_fw, cmd_debug_verify, 'VER', ver_fw)
 
     if status:
-        # BDID returns rotary switch position in TOCB app FW
-        # BDID returns 0 in TOCB bootloader
-        status = cmd_debug_verify(board, 'BDID', 'Board ID ' + ROTARY_SW)
-    if status:
-        status = cmd_debug_verify(board, 'BDT', 'IA')
-    if status:
-        status = check_board_revision(board, BOARD_REVISION)
-    if status:
-        status = cmd_debug_verify(board, 'MCUID', 'MCU ID 0x451, Rev 0x1001, SERNUM')
-    if status:
-        status = cmd_debug_verify(board, 'DGC', '0, 0, 0, 0, 0, 0, 0 No Faults #0')
+        status = p_board_identity(board)
 
-    if status:
+    f_current = status and p_fw_current(board, MCU_APP_FW_BIN)
+    if f_current:
+        myLog('firmware is current - RBL skipped', 's')
+
+    if status and not f_current:
         status = eth_cmd_write(board, 'RBL')
-        time.sleep(10)
+        p_board_rebooted(board)
+
+    if status and not f_current:
+        p_ports_close(board)
+        status = eth_wait_ready(board, ver_bl)
 
     if status:
         myLog('part 1 done - PASS', 'P')
     else:
         myLog('part 1 done - FAIL', 'F')
 
+    return status
+
 
 
 #-------------------------------------------------------------------------------
@@ -706,62 +1910,75 @@ def main_p1(board):
 #-------------------------------------------------------------------------------
 def main_p2(board):
     status = True
+    ver_bl = 'Ver ' + MCU_BL_VER + ' ' + FPGA_VER
 
     myLog(sys.argv[0]+' '+sys.argv[1]+' '+sys.argv[2]+' '+sys.argv[3], 's')
 
-    if not eth_ports_open(board):
-        sys.exit()
+    if not p_ports_open(board):
+        sys.exit(1)
 
-    if status:
-        status = cmd_debug_verify(board, 'VER', 'Ver ' + MCU_BL_VER + ' ' + FPGA_VER)
+    f_current = p_fw_current(board, MCU_APP_FW_BIN)
+    if f_current:
+        myLog('firmware is current - download skipped', 's')
 
-    if status:
-        eth_ports_close(board)
+    if status and not f_current:
+        status = p_verify_once(board, ver_bl, cmd_debug_verify, 'VER', ver_bl)
 
-    if status:
+    if status and not f_current:
+        p_ports_close(board)
+
+    if status and not f_current:
         status = programming_MCU_exe(board, MCU_APP_FW_BIN)
+        p_board_rebooted(board)
 
-    if status:
-        time.sleep(10)  # wait for board boot up to application firmware
+    if status and not f_current:
+        # wait for board boot up to application firmware
+        status = eth_wait_ready(board, 'Ver ' + MCU_FW_VER + ' ' + FPGA_VER)
+
+    if status and not f_current:
+        p_flash_add(board, MCU_APP_FW_BIN)
 
     if status:
         myLog('part 2 done - PASS', 'P')
     else:
         myLog('part 2 done - FAIL', 'F')
 
+    return status
+
 
 
 #-------------------------------------------------------------------------------
 # Description:
 # Parameter:
 #-------------------------------------------------------------------------------
-def main_p3(board):
+def main_p3(board, mode=''):
     status = True
+    ver_fw = 'Ver ' + MCU_FW_VER + ' ' + FPGA_VER
 
     myLog(sys.argv[0]+' '+sys.argv[1]+' '+sys.argv[2]+' '+sys.argv[3], 's')
 
-    if not eth_ports_open(board):
-        sys.exit()
+    if not p_ports_open(board):
+        sys.exit(1)
 
     if status:
-        status = cmd_debug_verify(board, 'VER', 'Ver ' + MCU_FW_VER + ' ' + FPGA_VER)
+        status = p_verify_once(board, ver_fw, cmd_debug_verify, 'VER', ver_fw)
 
     if status:
         status = POST(board, [])
 
     if status:
-        status = PICB_test_sequence(board)
+        status = PICB_test_sequence(board, mode)
 
     if status:
         status = POST(board, [])
 
-    eth_ports_close(board)
-
     if status:
         myLog('part 3 done - PASS', 'P')
     else:
         myLog('part 3 done - FAIL', 'F')
 
+    return status
+
 
 
 #-------------------------------------------------------------------------------
@@ -770,36 +1987,45 @@ def main_p3(board):
 #-------------------------------------------------------------------------------
 def main_p4(board):
     status = True
+    ver_fw = 'Ver ' + MCU_FW_VER + ' ' + FPGA_VER
 
     myLog(sys.argv[0]+' '+sys.argv[1]+' '+sys.argv[2]+' '+sys.argv[3], 's')
 
-    if not eth_ports_open(board):
-        sys.exit()
+    if not p_ports_open(board):
+        sys.exit(1)
 
     if status:
-        status = cmd_debug_verify(board, 'VER', 'Ver ' + MCU_FW_VER + ' ' + FPGA_VER)
+        status = p_verify_once(board, ver_fw, cmd_debug_verify, 'VER', ver_fw)
 
     if status:
-        # BDID returns rotary switch position in TOCB app FW
-        # BDID returns 0 in TOCB bootloader
-        status = cmd_debug_verify(board, 'BDID', 'Board ID ' + ROTARY_SW)
-    if status:
-        status = cmd_debug_verify(board, 'BDT', 'IA')
-    if status:
-        status = check_board_revision(board, BOARD_REVISION)
-    if status:
-        status = cmd_debug_verify(board, 'MCUID', 'MCU ID 0x451, Rev 0x1001, SERNUM')
-    if status:
-        status = cmd_debug_verify(board, 'DGC', '0, 0, 0, 0, 0, 0, 0 No Faults #0')
-
-    eth_ports_close(board)
+        status = p_board_identity(board)
 
     if status:
         myLog('part 4 done - PASS', 'P')
     else:
         myLog('part 4 done - FAIL', 'F')
 
-    pass
+    return status
+
+
+
+#-------------------------------------------------------------------------------
+# Description:  all parts in one process
+#   bootloader switch -> flash -> functional test -> final check, keeping the
+#   board connection and the verified checks between the parts. The ports are
+#   re-opened by eth_wait_ready after the RBL and flash reboots.
+# Parameter:
+#-------------------------------------------------------------------------------
+def main_all(board):
+    status = True
+
+    for item, part in [('1', main_p1), ('2', main_p2), ('3', main_p3), ('4', main_p4)]:
+        if status:
+            if F_CAPTURE:   # a transcript per part, see p_replay
+                trace_start(board, item)
+            status = part(board)
+
+    return status
 
 
 
@@ -836,42 +2062,580 @@ def main_p999(board):
 
 
 #-------------------------------------------------------------------------------
-# Description:
+# Description:  ict_result_parse on one run of the board log
+#   the run (-1 = latest) is found with the run index of picb_log.py and
+#   copied to <log_file_name>_run_log.txt, so parsing takes the same time
+#   however many runs the log holds
+#-------------------------------------------------------------------------------
+def p_result_parse(log_file, run=-1):
+    log_flush()
+    run_file = log_file[:-len('_log.txt')] + '_run_log.txt'
+
+    try:
+        run = log_run_extract(log_file, run, run_file)
+    except (IOError, ValueError) as e:
+        myLog('result parse: ' + str(e), 'F')
+        return False
+
+    myLog('result parse: run ' + str(run) + ' of ' + log_file, 's')
+    try:
+        return ict_result_parse(run_file)
+    finally:
+        os.remove(run_file)
+
+
+#-------------------------------------------------------------------------------
+# Description:  optional timing instrumentation
+#   instrument_enable() wraps the board I/O functions (INSTR_IO), the test
+#   steps (INSTR_STEPS) and p_sleep. Each call records its latency in a
+#   histogram (INSTR_BUCKETS, ms) and the bytes sent and received.
+#   instrument_report() prints the ranked table at the end of
+#   PICB_test_sequence. The step named by PROFILE_STEP also runs under cProfile.
+#   Enabled with PICB_INSTRUMENT=1, PICB_PROFILE=<step> in the environment.
+#-------------------------------------------------------------------------------
+INSTR = {}
+f_instrumented = False
+
+
+def instrument_enable():
+    global f_instrumented
+    if f_instrumented:
+        return
+
+    g = globals()
+    for name in INSTR_IO + ['p_sleep']:
+        g[name] = p_instr_wrap(name, g[name], f_step=False)
+    for name in INSTR_STEPS:
+        g[name] = p_instr_wrap(name, g[name], f_step=True)
+
+    f_instrumented = True
+
+
+def instrument_reset():
+    INSTR.clear()
+
+
+def p_instr_wrap(name, func, f_step):
+    def p_instr(*args, **kwargs):
+        if not (F_INSTRUMENT or PROFILE_STEP):     # a later server job without it
+            return func(*args, **kwargs)
+
+        key = name
+        if f_step and len(args) > 1:
+            key = name + '(' + ', '.join(str(a) for a in args[1:]) + ')'
+
+        t0 = time.perf_counter()
+        if f_step and name == PROFILE_STEP:
+            prof = cProfile.Profile()
+            rtn = prof.runcall(func, *args, **kwargs)
+            p_instr_profile(key, prof)
+        else:
+            rtn = func(*args, **kwargs)
+        dt = time.perf_counter() - t0
+
+        rec = INSTR.setdefault(key, {'kind': 'step' if f_step else 'io',
+                                     'calls': 0, 'total': 0.0, 'max': 0.0,
+                                     'bytes': 0, 'hist': [0] * (len(INSTR_BUCKETS) + 1)})
+        rec['calls'] += 1
+        rec['total'] += dt
+        rec['max'] = max(rec['max'], dt)
+        rec['hist'][p_instr_bucket(dt * 1000.0)] += 1
+        if not f_step:
+            rec['bytes'] += p_instr_bytes(args[1:]) + p_instr_bytes(rtn)
+
+        return rtn
+
+    return p_instr
+
+
+# characters of a str, or of the strs in a list (p_cmd_batch commands / replies)
+def p_instr_bytes(value):
+    if isinstance(value, str):
+        return len(value)
+    if isinstance(value, (list, tuple)):
+        return sum(p_instr_bytes(v) for v in value)
+    return 0
+
+
+def p_instr_bucket(ms):
+    for i, limit in enumerate(INSTR_BUCKETS):
+        if ms < limit:
+            return i
+    return len(INSTR_BUCKETS)
+
+
+def p_instr_profile(key, prof):
+    stats = pstats.Stats(prof)
+    stats.sort_stats('cumulative').print_stats(25)
+    if len(sys.argv) > 2:
+        stats.dump_stats(sys.argv[2] + '_' + PROFILE_STEP + '.prof')
+    myLog('cProfile of ' + key + ' done', 'd')
+
+
+def instrument_report():
+    if not INSTR:
+        return
+
+    lines = ['where did the time go (steps include their I/O and sleeps)']
+    lines.append('{:<36} {:>6} {:>9} {:>8} {:>8} {:>8}'.format(
+        'item', 'calls', 'total s', 'mean ms', 'max ms', 'bytes'))
+    for key, rec in sorted(INSTR.items(), key=lambda kv: -kv[1]['total']):
+        lines.append('{:<36} {:>6} {:>9.3f} {:>8.2f} {:>8.2f} {:>8}'.format(
+            key, rec['calls'], rec['total'], rec['total'] * 1000.0 / rec['calls'],
+            rec['max'] * 1000.0, rec['bytes'] if rec['kind'] == 'io' else ''))
+
+    lines.append('latency histogram, ms: <' + ' <'.join(str(b) for b in INSTR_BUCKETS) + ' more')
+    for key, rec in sorted(INSTR.items()):
+        if rec['kind'] == 'io':
+            lines.append('{:<36} {}'.format(key, ' '.join(str(n) for n in rec['hist'])))
+
+    for line in lines:
+        print(line)
+        myLog(line, 'd')
+
+
+#-------------------------------------------------------------------------------
+# Description:  board transcripts
+#   trace_enable() wraps the board I/O functions (TRACE_IO) here and, where
+#   my_ict has them, in my_ict, like the debug reader does. With PICB_CAPTURE=1
+#   every launch writes the calls and their replies with the time since the
+#   start to <log_file_name>_<time>_<item>_trace.jsonl.gz, the test
+#   conditions and the board state (open ports, state shadow, checks already
+#   proven) in the first line. Test item 'all' writes one transcript per part.
+#   Calls made from inside a traced call are not recorded.
+#
+#   Test item 'replay' runs the newest part 3 transcript of <log_file_name>,
+#   or the part 3 / part 4 transcript PICB_REPLAY, through main_p3 / main_p4
+#   again: the traced functions return the recorded replies in order,
+#   TRACE_LOCAL return True, p_sleep and p_time follow the transcript clock.
+#   The steps are graded with the current plan; checkpoint and step history
+#   are not touched, the result rows are stored with ' replay' in the run.
+#-------------------------------------------------------------------------------
+TRACE = None
+REPLAY = None
+TRACE_DEPTH = threading.local()     # traced calls running in this thread
+f_traced = False
+
+
+def trace_enable():
+    global f_traced
+    if f_traced:
+        return
+
+    g = globals()
+    for name in TRACE_IO + TRACE_LOCAL:
+        g[name] = p_trace_wrap(name, g[name])
+        if hasattr(my_ict, name):
+            setattr(my_ict, name, g[name])
+
+    f_traced = True
+
+
+def p_trace_wrap(name, func):
+    def p_trace(*args):
+        if REPLAY is not None:
+            return True if name in TRACE_LOCAL else REPLAY.call(name, args[1:])
+        if TRACE is None or name in TRACE_LOCAL or getattr(TRACE_DEPTH, 'depth', 0):
+            return func(*args)
+
+        TRACE_DEPTH.depth = 1
+        try:
+            rtn = func(*args)
+        finally:
+            TRACE_DEPTH.depth = 0
+        TRACE.add(name, args[1:], rtn)
+        return rtn
+
+    return p_trace
+
+
+# transcript writer of one launch
+class TraceWriter(object):
+
+    def __init__(self, path, head):
+        self.path = path
+        self.t0 = time.time()
+        self.lock = threading.Lock()
+        self.f = gzip.open(path, 'wt')
+        self.f.write(json.dumps(head, sort_keys=True) + '\n')
+
+    def add(self, name, args, rtn):
+        line = json.dumps({'t': round(time.time() - self.t0, 4), 'f': name,
+                           'a': args, 'r': rtn}, default=str)
+        with self.lock:
+            self.f.write(line + '\n')
+
+    def close(self):
+        with self.lock:
+            self.f.close()
+
+
+# recorded replies of a transcript, in call order
+class TraceReplay(object):
+
+    def __init__(self, path):
+        self.path = path
+        with gzip.open(path, 'rt') as f:
+            self.head = json.loads(f.readline())
+            self.recs = [json.loads(line) for line in f if line.strip()]
+        self.pos = 0
+        self.used = 0
+        self.clock = 0.0
+
+    # the next record of this call; records the current code does not ask
+    # for any more (e.g. a point the adaptive sweep now skips) are passed over
+    def call(self, name, args):
+        args = json.loads(json.dumps(args, default=str))
+        for i in range(self.pos, len(self.recs)):
+            rec = self.recs[i]
+            if rec['f'] == name and rec['a'] == args:
+                self.pos = i + 1
+                self.used += 1
+                self.clock = max(self.clock, rec['t'])
+                return rec['r']
+
+        myLog('replay: ' + name + ' ' + str(args) + ' not in ' + self.path, 'F')
+        sys.exit('transcript ' + self.path + ' does not cover this test run')
+
+    def sleep(self, sec):
+        self.clock += sec
+
+
+def trace_start(board, item):
+    global TRACE
+    trace_stop()
+    trace_enable()
+    path = sys.argv[2] + '_' + time.strftime('%Y%m%d-%H%M%S') + '_' + item + TRACE_SUFFIX
+    TRACE = TraceWriter(path, {'script_ver': SCRIPT_VER, 'plan': PLAN_FILE,
+                               'board': sys.argv[2], 'ip': board['ipAddr'],
+                               'item': item, 'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+                               'f_open': bool(board.get('f_open')),
+                               'shadow': board.get('shadow', {}),
+                               'proven': sorted(board.get('proven', ()))})
+
+
+def trace_stop():
+    global TRACE
+    if TRACE is not None:
+        TRACE.close()
+        TRACE = None
+
+
+# newest transcript of a board and test item in log/
+def p_trace_latest(log_name, item):
+    pattern = re.compile(re.escape(log_name) + r'_\d{8}-\d{6}_' + re.escape(item) +
+                         re.escape(TRACE_SUFFIX) + '$')
+    names = sorted(n for n in os.listdir('.') if pattern.match(n))
+    return names[-1] if names else None
+
+
+#-------------------------------------------------------------------------------
+# Description:  test item 'replay', re-grade a recorded run without the board
+#   the board dict is copied with the state of the transcript, the fixture
+#   connection of a server stays as it is
 # Parameter:
+#   path        transcript, None for the newest one of test item item
 #-------------------------------------------------------------------------------
-if __name__ == '__main__':
+def p_replay(board, path=None, item='3'):
+    global REPLAY
+    path = path or p_trace_latest(sys.argv[2], item)
+    if not path or not os.path.exists(path):
+        myLog('replay: no transcript of ' + sys.argv[2], 'F')
+        return False
+
+    replay = TraceReplay(path)
+    item = replay.head.get('item')
+    if item not in REPLAY_ITEMS:
+        myLog('replay: test item ' + str(item) + ' of ' + path + ' cannot be replayed', 'F')
+        return False
+
+    myLog('replay of ' + path + ' (' + replay.head.get('time', '') + ', ' +
+          str(replay.head.get('script_ver')) + ')', 's')
+    head = replay.head
+    board = dict(board, cmdHandle=None, debugHandle=None, debugReader=None,
+                 f_open=head.get('f_open', False), shadow=head.get('shadow', {}),
+                 proven=set(head.get('proven', [])), results=None)
+    trace_enable()
+    REPLAY = replay
+    try:
+        status = main_p3(board) if item == '3' else main_p4(board)
+    finally:
+        p_ports_close(board)    # the ports of the transcript, not the fixture's
+        REPLAY = None
+
+    myLog('replay: {} of {} exchanges used'.format(replay.used, len(replay.recs)), 's')
+    return status
+
+
+atexit.register(trace_stop)
+
+
+#-------------------------------------------------------------------------------
+# Description:  look up the fixture board dict by its IP address
+# Parameter:
+#   ip      board IP address as given on the command line
+#-------------------------------------------------------------------------------
+def p_board_find(ip):
+    for board in PICB_BOARDS:
+        if board['ipAddr'] == ip:
+            return board
+
+    return None
+
+
+#-------------------------------------------------------------------------------
+# Description:  run one test item on several fixtures at the same time
+#   myLog writes to one log per process, so every board runs in its own child
+#   process (ict_picb.py <ip> <log> <item>) driven by a supervisor thread. The
+#   child keeps its own <log>_log.txt and reports pass/fail via its exit code.
+#   Console output of each child is prefixed with its IP address.
+# Parameter:
+#   ips         list of board IP addresses
+#   logs        list of log file names, one per board
+#   test_item   test item passed to every child
+#   cwd         directory the children are started from
+#-------------------------------------------------------------------------------
+def PICB_multi_board(ips, logs, test_item, cwd):
+    results = {}
+    lock = threading.Lock()
+
+    def p_run(ip, log):
+        cmd = [sys.executable, os.path.abspath(__file__), ip, log, test_item]
+        proc = subprocess.Popen(cmd, cwd=cwd, stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT,
+                                universal_newlines=True)
+        for line in proc.stdout:
+            with lock:
+                print('[' + ip + '] ' + line.rstrip())
+        results[ip] = (proc.wait() == 0)
+
+    threads = []
+    for ip, log in zip(ips, logs):
+        t = threading.Thread(target=p_run, args=(ip, log), name='picb_' + ip)
+        t.start()
+        threads.append(t)
+
+    for t in threads:
+        t.join()
+
+    print('\nmulti-board result - test item ' + test_item)
+    for ip, log in zip(ips, logs):
+        print('  ' + ip + '  ' + log + '  ' + ('PASS' if results.get(ip) else 'FAIL'))
+
+    return all(results.get(ip) for ip in ips)
+
+
+#-------------------------------------------------------------------------------
+# Description:  one launch, run from the station directory, exits with 0 on
+#   PASS. f_serve keeps the board ports open for the next job of serve().
+# Parameter:
+#   ict_picb.py <ip_address> <log_file_name> <test_item>
+#   ict_picb.py <ip,ip,...> <log,log,...> <test_item>    multi-board mode
+#   ict_picb.py --serve                                   server mode
+#   test_item   1, 2, 3, 4, all (1 to 4 in one process), 999
+#               3r      resume the test sequence after the last checkpoint
+#               3f      rerun the failed sequence steps only
+#               parse   ict_result_parse of run PICB_PARSE_RUN of the log
+#               replay  re-grade the latest part 3 transcript (PICB_REPLAY)
+#-------------------------------------------------------------------------------
+def p_main(f_serve=False):
     status = True
+    start_dir = os.getcwd()
     os.chdir('log')
 
     if len(sys.argv) != 4:
         print('Invalid command - missing parameter')
         print('format: ict_picb.py <ip_address> <log_file_name> <test_item>')
+        print('        ict_picb.py <ip,ip,...> <log,log,...> <test_item>')
         print('\n\nExiting ...')
         time.sleep(5)
-        sys.exit()
+        sys.exit(1)
+
+    ips = sys.argv[1].split(',')
+    logs = sys.argv[2].split(',')
 
-    if sys.argv[1] != picb0['ipAddr']:
+    if len(ips) != len(logs) or None in [p_board_find(ip) for ip in ips]:
         print('format: ict_picb.py <ip_address> <log_file_name> <test_item>')
         print('Wrong IP address')
         print('\n\nExiting ...')
         time.sleep(5)
-        sys.exit()
+        sys.exit(1)
 
-    board = picb0
+    if len(ips) > 1:
+        status = PICB_multi_board(ips, logs, sys.argv[3], start_dir)
+        sys.exit(0 if status else 1)
+
+    board = p_board_find(sys.argv[1])
+
+    if sys.argv[3] in ['1', 'all']:     # a new run starts, see picb_log.py
+        log_rotate(sys.argv[2] + '_log.txt', '.', ARCHIVE_COMP)
+        archive_sweep('.', ARCHIVE_COMP)
+
+    if f_serve:
+        p_board_reset(board, sys.argv[3])
+
+    if F_INSTRUMENT or PROFILE_STEP:
+        instrument_enable()
+
+    if F_CAPTURE and sys.argv[3] not in ['all', 'parse', 'replay', '999']:
+        trace_start(board, sys.argv[3])
 
     if sys.argv[3] == '1':      # switching to bootloader
-        main_p1(board)
+        status = main_p1(board)
     elif sys.argv[3] == '2':    # downloadng App firmware
-        main_p2(board)
-    elif sys.argv[3] == '3':
-        main_p3(board)
+        status = main_p2(board)
+    elif sys.argv[3] in SEQ_MODES:  # '3r' resume, '3f' failed steps only
+        status = main_p3(board, SEQ_MODES[sys.argv[3]])
     elif sys.argv[3] == '4':
-        main_p4(board)
-        ict_result_parse(sys.argv[2] + '_log.txt')
+        status = main_p4(board)
+    elif sys.argv[3] == 'all':  # parts 1 to 4 in one process
+        status = main_all(board)
     elif sys.argv[3] == '999':
         main_p999(board)
+    elif sys.argv[3] == 'parse':    # result of run PICB_PARSE_RUN, no board I/O
+        status = p_result_parse(sys.argv[2] + '_log.txt', PARSE_RUN)
+    elif sys.argv[3] == 'replay':   # re-grade the latest transcript, no board I/O
+        status = p_replay(board, REPLAY_FILE and os.path.join(start_dir, REPLAY_FILE))
 
-    pass
+    trace_stop()
 
+    if f_serve:
+        p_results_flush(board, f_close=True)    # ports stay open for the next job
+    else:
+        p_ports_close(board)
 
+    if sys.argv[3] in ['4', 'all']:
+        p_result_parse(sys.argv[2] + '_log.txt')
+
+    sys.exit(0 if status else 1)
+
+
+
+#-------------------------------------------------------------------------------
+# Description:  server mode, ict_picb.py --serve
+#   keeps the modules imported and the board ports open between launches.
+#   ict_picb_client.py sends the usual <ip> <log> <item> arguments, its
+#   working directory and its PICB_* environment over SERVE_SOCK (TCP
+#   127.0.0.1:SERVE_PORT where Python has no AF_UNIX); the job runs exactly
+#   like a launch of this script, its console output goes back to the client,
+#   followed by SERVE_EXIT <code>. Jobs run one at a time in arrival order.
+#-------------------------------------------------------------------------------
+def serve():
+    if hasattr(socket, 'AF_UNIX'):
+        addr = os.path.abspath(SERVE_SOCK)
+        if os.path.exists(addr):
+            os.remove(addr)
+        srv = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    else:
+        addr = ('127.0.0.1', SERVE_PORT)
+        srv = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    srv.bind(addr)
+    srv.listen(16)
+    print('ict_picb serving on ' + str(addr))
+
+    while True:
+        conn, peer = srv.accept()
+        try:
+            p_serve_job(conn)
+        finally:
+            conn.close()
+        if f_terminated:    # the signal ended the job, now the server
+            sys.exit(1)
+
+
+# console text of a job to the client, a client gone is ignored
+class ServeOut(object):
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def write(self, text):
+        if self.conn is not None:
+            try:
+                self.conn.sendall(text.encode('utf-8', 'replace'))
+            except socket.error:
+                self.conn = None
+        return len(text)
+
+    def flush(self):
+        pass
+
+
+def p_serve_job(conn):
+    req = json.loads(conn.makefile('rb').readline().decode('utf-8'))
+    out = ServeOut(conn)
+    code = 1
+
+    env = dict(os.environ)
+    for key in [k for k in os.environ if k.startswith('PICB_')]:
+        del os.environ[key]
+    os.environ.update(req.get('env', {}))
+    p_env_load()
+
+    with contextlib.redirect_stdout(out), contextlib.redirect_stderr(out):
+        try:
+            os.chdir(req['cwd'])
+            sys.argv = [os.path.abspath(__file__)] + req['argv']
+            p_main(f_serve=True)
+        except SystemExit as e:
+            if e.code is None or isinstance(e.code, int):
+                code = e.code or 0
+            else:
+                print(e.code)
+        except Exception:
+            traceback.print_exc()
+        finally:
+            log_flush()
+            os.environ.clear()
+            os.environ.update(env)
+            p_env_load()
+
+    out.write('\n' + SERVE_EXIT + str(code) + '\n')
+
+
+# ports of a board open since an earlier job, False if the board does not
+# answer VER on them; a board pulled from the fixture sends no FIN, so only a
+# round trip tells
+def p_ports_alive(board):
+    if not board.get('f_open'):
+        return False
+    reader = board.get('debugReader')
+    if reader is not None and not reader.f_run:
+        return False
+
+    try:
+        rtn = eth_cmd_write(board, 'VER')
+        temp = eth_debug_read(board)
+    except (socket.error, socket.timeout):
+        return False
+
+    return parse_ver(str(rtn) + str(temp)) is not None
+
+
+#-------------------------------------------------------------------------------
+# Description:  start of a server job, another board may be in the fixture now
+#   the checks and state of the last job are forgotten and debug lines left
+#   over from it are dropped. Items 1 and all start a board from scratch on
+#   new ports; the other board items keep the ports while VER answers on them.
+#-------------------------------------------------------------------------------
+def p_board_reset(board, item):
+    board['proven'] = set()
+    board['shadow'] = {}
+    board['results'] = None
+
+    reader = board.get('debugReader')
+    if reader is not None:
+        reader.drain()
+
+    if item in ['1', 'all']:
+        p_ports_close(board)
+    elif item not in ['parse', 'replay', '999'] and not p_ports_alive(board):
+        p_ports_close(board)
+
+
+if __name__ == '__main__':
+    if sys.argv[1:] == ['--serve']:
+        serve()
 
+    p_main()
@@ -0,0 +1,72 @@
+#-------------------------------------------------------------------------------
+# Name:        ict_picb_client
+# Purpose:     station harness front end for a running 'ict_picb.py --serve'
+#
+#   ict_picb_client.py <ip_address> <log_file_name> <test_item>
+#
+#   Same arguments, working directory, PICB_* environment, console output and
+#   exit code as ict_picb.py, without the start-up cost: the job is sent to the server
+#   started from this directory. Without a server ict_picb.py is run as
+#   before. Keep SERVE_SOCK / SERVE_PORT / SERVE_EXIT in step with
+#   ict_picb.py; this file does not import it so it starts fast.
+#
+#-------------------------------------------------------------------------------
+import os
+import sys
+import json
+import socket
+import subprocess
+
+
+SERVE_SOCK      = 'ict_picb.sock'
+SERVE_PORT      = 50100
+SERVE_EXIT      = b'\0exit '
+
+
+def p_connect():
+    try:
+        if hasattr(socket, 'AF_UNIX'):
+            s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            s.connect(os.path.abspath(SERVE_SOCK))
+        else:
+            s = socket.create_connection(('127.0.0.1', SERVE_PORT))
+    except socket.error:
+        return None
+
+    return s
+
+
+if __name__ == '__main__':
+    s = p_connect()
+    if s is None:
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ict_picb.py')
+        sys.exit(subprocess.call([sys.executable, script] + sys.argv[1:]))
+
+    env = dict((k, v) for k, v in os.environ.items() if k.startswith('PICB_'))
+    s.sendall(json.dumps({'argv': sys.argv[1:], 'cwd': os.getcwd(),
+                          'env': env}).encode('utf-8') + b'\n')
+
+    out = getattr(sys.stdout, 'buffer', sys.stdout)
+    tail = b''
+    while True:
+        data = s.recv(65536)
+        if not data:
+            break
+        tail += data
+        # hold back what could be the start of the exit line
+        cut = tail.rfind(b'\n', 0, max(0, len(tail) - 64))
+        if cut >= 0:
+            out.write(tail[:cut + 1])
+            out.flush()
+            tail = tail[cut + 1:]
+
+    code = 1
+    pos = tail.rfind(SERVE_EXIT)
+    if pos >= 0:
+        code = int(tail[pos + len(SERVE_EXIT):].strip() or 1)
+        tail = tail[:pos].rstrip(b'\n')
+        if tail:
+            tail += b'\n'
+    out.write(tail)
+    out.flush()
+    sys.exit(code)
@@ -0,0 +1,269 @@
+#-------------------------------------------------------------------------------
+# Name:        picb_bench
+# Purpose:     throughput benchmark of the ICT flow against picb_sim boards
+#
+#   Starts picb_sim.py in its own process with the given per-command latency
+#   and runs main_p1 .. main_p4 and every PICB_* test function of ict_picb.py
+#   against it. For each item it reports wall time, round-trips and the split
+#   between time.sleep, board I/O and CPU. Boards per hour are measured by
+#   running the whole flow (test item 'all') on 1, 3 and N simulated fixtures
+#   at the same time, each fixture in its own process and with its own log
+#   name like PICB_multi_board. The result is written as JSON.
+#
+#   python picb_bench.py [--latency s] [--parallel 1,3,6] [--out file.json]
+#   python picb_bench.py --fixture cmd_port:debug_port --serial name
+#
+#-------------------------------------------------------------------------------
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import tempfile
+import threading
+import traceback
+import subprocess
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# functions counted as one board round-trip, nested calls are not counted again
+IO_FUNCS = ['eth_ports_open', 'eth_cmd_write', 'eth_debug_read',
+            'eth_debug_read_find', 'cmd_debug_verify', 'check_board_revision',
+            'r16', 'AIN_read', 'POST', 'p_cmd_batch']
+
+
+#-------------------------------------------------------------------------------
+# Description:  per-thread counters, so parallel boards are counted apart
+#-------------------------------------------------------------------------------
+class BenchStats(object):
+
+    def __init__(self):
+        self.local = threading.local()
+
+    def reset(self):
+        self.local.rec = {'round_trips': 0, 'io': 0.0, 'sleep': 0.0}
+        self.local.depth = 0
+        self.local.sleep_in_io = 0.0
+        return self.local.rec
+
+    def rec(self):
+        if not hasattr(self.local, 'rec'):
+            self.reset()
+        return self.local.rec
+
+    def wrap_io(self, func):
+        stats = self
+
+        def p_io(*args, **kwargs):
+            rec = stats.rec()
+            stats.local.depth += 1
+            if stats.local.depth == 1:
+                stats.local.sleep_in_io = 0.0
+            t0 = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                stats.local.depth -= 1
+                if stats.local.depth == 0:
+                    rec['round_trips'] += 1
+                    rec['io'] += time.perf_counter() - t0 - stats.local.sleep_in_io
+
+        return p_io
+
+    def wrap_sleep(self, func):
+        stats = self
+
+        def p_sleep(sec):
+            rec = stats.rec()
+            t0 = time.perf_counter()
+            func(sec)
+            dt = time.perf_counter() - t0
+            rec['sleep'] += dt
+            if getattr(stats.local, 'depth', 0):
+                stats.local.sleep_in_io += dt
+
+        return p_sleep
+
+
+#-------------------------------------------------------------------------------
+# Description:  simulator process and board dicts
+#-------------------------------------------------------------------------------
+def sim_process(ports, latency, reboot_time):
+    cmd = [sys.executable, os.path.join(HERE, 'picb_sim.py'),
+           '--latency', str(latency), '--reboot-time', str(reboot_time)]
+    for cmd_port, debug_port in ports:
+        cmd += ['--board', '127.0.0.1:{}:{}'.format(cmd_port, debug_port)]
+    proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL)
+
+    t_end = time.time() + 10
+    for cmd_port, debug_port in ports:
+        while True:
+            try:
+                socket.create_connection(('127.0.0.1', cmd_port), timeout=0.2).close()
+                break
+            except socket.error:
+                if time.time() > t_end:
+                    proc.kill()
+                    sys.exit('picb_sim did not start')
+                time.sleep(0.05)
+
+    return proc
+
+
+def sim_board(cmd_port, debug_port):
+    return {'cmdHandle': None, 'debugHandle': None, 'ipAddr': '127.0.0.1',
+            'cmdPort': cmd_port, 'debugPort': debug_port, 'prompt': '>'}
+
+
+# stands in for programming_MCU_exe: the simulator reboots into app mode
+def sim_programming(board, bin_file):
+    s = socket.create_connection((board['ipAddr'], board['cmdPort']), timeout=2)
+    s.sendall(b'SIMBOOT app\r\n')
+    s.recv(4096)
+    s.close()
+    return True
+
+
+#-------------------------------------------------------------------------------
+# Description:  run one item, returns its record
+#-------------------------------------------------------------------------------
+def bench_item(stats, name, func, *args):
+    rec = stats.reset()
+    t_wall = time.perf_counter()
+    t_cpu = time.process_time()
+    try:
+        status = func(*args)
+    except SystemExit:
+        status = False
+    rec['wall'] = time.perf_counter() - t_wall
+    rec['cpu'] = time.process_time() - t_cpu
+    rec['pass'] = bool(status)
+    rec['other'] = max(0.0, rec['wall'] - rec['sleep'] - rec['io'])
+    print('{:<32} {:8.3f}s  rt {:5d}  sleep {:7.3f}s  io {:7.3f}s  cpu {:7.3f}s  {}'.format(
+        name, rec['wall'], rec['round_trips'], rec['sleep'], rec['io'], rec['cpu'],
+        'PASS' if rec['pass'] else 'FAIL'))
+
+    return rec
+
+
+#-------------------------------------------------------------------------------
+# Description:  one fixture of bench_parallel, test item 'all' in this process,
+#   exits with 0 on PASS. An exception is a FAIL.
+#-------------------------------------------------------------------------------
+def bench_fixture(cmd_port, debug_port, serial):
+    sys.path.insert(0, HERE)
+    sys.argv = ['ict_picb.py', '127.0.0.1', serial, 'all']
+
+    import ict_picb as ict
+    ict.programming_MCU_exe = sim_programming
+
+    board = sim_board(cmd_port, debug_port)
+    try:
+        status = ict.main_all(board)
+    except Exception:
+        traceback.print_exc()
+        status = False
+    finally:
+        ict.p_ports_close(board)
+
+    sys.exit(0 if status else 1)
+
+
+def bench_parallel(ports, work_dir):
+    results = {}
+
+    def p_run(i, cmd_port, debug_port):
+        serial = 'bench{}'.format(i)
+        cmd = [sys.executable, os.path.abspath(__file__),
+               '--fixture', '{}:{}'.format(cmd_port, debug_port), '--serial', serial]
+        proc = subprocess.Popen(cmd, cwd=work_dir, stdout=subprocess.DEVNULL)
+        results[serial] = (proc.wait() == 0)
+
+    t0 = time.perf_counter()
+    threads = [threading.Thread(target=p_run, args=(i,) + p) for i, p in enumerate(ports)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - t0
+
+    passed = sum(results.values())
+    return {'wall': wall, 'boards_per_hour': passed * 3600.0 / wall,
+            'boards': len(ports), 'passed': passed}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='ICT flow throughput benchmark')
+    parser.add_argument('--latency', type=float, default=0.002,
+                        help='simulated per-command latency, seconds')
+    parser.add_argument('--reboot-time', type=float, default=2.0)
+    parser.add_argument('--parallel', default='1,3',
+                        help='fixture counts for boards per hour, e.g. 1,3,6')
+    parser.add_argument('--base-port', type=int, default=53000)
+    parser.add_argument('--out', default='', help='JSON result file')
+    parser.add_argument('--fixture', default='',
+                        help='cmd_port:debug_port, run one fixture of --parallel')
+    parser.add_argument('--serial', default='bench')
+    args = parser.parse_args()
+
+    if args.fixture:
+        bench_fixture(*[int(p) for p in args.fixture.split(':')], serial=args.serial)
+
+    n_par = [int(n) for n in args.parallel.split(',')]
+    ports = [(args.base_port + 2*i, args.base_port + 2*i + 1) for i in range(max(n_par))]
+    proc = sim_process(ports, args.latency, args.reboot_time)
+
+    out_file = os.path.abspath(args.out) if args.out else ''
+    sys.path.insert(0, HERE)
+    work_dir = tempfile.mkdtemp(prefix='picb_bench_')
+    os.chdir(work_dir)
+    sys.argv = ['ict_picb.py', '127.0.0.1', 'bench', 'all']
+
+    import ict_picb as ict
+
+    stats = BenchStats()
+    for name in IO_FUNCS:
+        setattr(ict, name, stats.wrap_io(getattr(ict, name)))
+    ict.programming_MCU_exe = stats.wrap_io(sim_programming)
+    time.sleep = stats.wrap_sleep(time.sleep)
+
+    result = {'script_ver': ict.SCRIPT_VER, 'latency': args.latency,
+              'reboot_time': args.reboot_time, 'items': {}, 'parallel': {}}
+
+    try:
+        # a fresh board dict per part, like one ict_picb.py launch per part
+        for name, func in [('main_p1', ict.main_p1), ('main_p2', ict.main_p2),
+                           ('main_p3', ict.main_p3), ('main_p4', ict.main_p4)]:
+            board = sim_board(*ports[0])
+            result['items'][name] = bench_item(stats, name, func, board)
+            ict.p_ports_close(board)
+
+        board = sim_board(*ports[0])
+        ict.p_ports_open(board)
+        for name, func, fargs in [
+                ('PICB_supply_voltage', ict.PICB_supply_voltage, ()),
+                ('PICB_GPIO_test', ict.PICB_GPIO_test, ()),
+                ('PICB_pressue_sensor', ict.PICB_pressue_sensor, ()),
+                ('PICB_LLS_test_chX 0 100', ict.PICB_LLS_test_chX, (0, 100)),
+                ('PICB_LLS_test_ch4 100', ict.PICB_LLS_test_ch4, (100,)),
+                ('PICB_LLS_chX_debug 0 100', ict.PICB_LLS_chX_debug, (0, 100)),
+                ('PICB_test_sequence', ict.PICB_test_sequence, ())]:
+            result['items'][name] = bench_item(stats, name, func, board, *fargs)
+        ict.p_ports_close(board)
+
+        for n in n_par:
+            rec = bench_parallel(ports[:n], work_dir)
+            result['parallel'][str(n)] = rec
+            print('{} fixture(s): {:8.1f} boards/h  {}/{} PASS'.format(
+                n, rec['boards_per_hour'], rec['passed'], rec['boards']))
+    finally:
+        proc.kill()
+
+    text = json.dumps(result, indent=2, sort_keys=True)
+    if out_file:
+        with open(out_file, 'w') as f:
+            f.write(text)
+    else:
+        print(text)
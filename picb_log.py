@@ -0,0 +1,317 @@
+#-------------------------------------------------------------------------------
+# Name:        picb_log
+# Purpose:     run index of the per-board ICT log files
+#
+#   A board log (<log_file_name>_log.txt) gets the runs of every launch
+#   appended. main_p1 starts each run with the myTime(2) line and a '=' * 79
+#   banner. log_index() keeps the byte offset of every run start in
+#   <log>.idx and only scans what was appended since the last call, so
+#   finding a run does not depend on the size of the log. log_run_extract()
+#   copies one run in chunks.
+#
+#   Closed log segments are compressed into archive/<YYYY-MM>/ with one
+#   manifest.jsonl line each: log_rotate() closes a board log that got too
+#   big or holds too many runs, archive_sweep() moves out the files of boards
+#   not tested for ARCHIVE_IDLE_DAYS and deletes segments older than
+#   ARCHIVE_MAX_DAYS.
+#
+#   python picb_log.py log/SN_log.txt               list the runs
+#   python picb_log.py log/SN_log.txt --run -1 --out last.txt
+#   python picb_log.py --find SN [--dir log]        archived segments of SN
+#   python picb_log.py --sweep [--dir log]          archive sweep now
+#
+#-------------------------------------------------------------------------------
+import os
+import re
+import sys
+import time
+import gzip
+import json
+import argparse
+
+
+LOG_BANNER      = b'=' * 79
+IDX_SUFFIX      = '.idx'
+IDX_HEAD        = 256       # bytes of the log kept to notice a replaced file
+COPY_CHUNK      = 1 << 20
+
+# archive, see log_rotate / archive_sweep
+ARCHIVE_DIR     = 'archive'
+ARCHIVE_MANIFEST = 'manifest.jsonl'
+ARCHIVE_SUFFIXES = ['_log.txt', '_LLS.csv', '_ckpt.json',     # per board serial
+                    '_trace.jsonl.gz']  # <serial>_<YYYYmmdd-HHMMSS>_<item>_trace...
+LOG_ROTATE_SIZE = 16 << 20  # bytes, a bigger board log is closed
+LOG_ROTATE_RUNS = 20        # runs, a board log with more runs is closed
+ARCHIVE_IDLE_DAYS = 7       # board files untouched this long are archived
+ARCHIVE_MAX_DAYS = 730      # segments older than this are deleted
+ARCHIVE_SWEEP_HOURS = 12    # archive_sweep runs at most this often
+ARCHIVE_LOCK_STALE = 3600   # seconds, lock of a crashed sweep
+
+
+def p_idx_save(path, idx):
+    with open(path + '.tmp', 'w') as f:
+        json.dump(idx, f)
+    os.replace(path + '.tmp', path)
+
+
+#-------------------------------------------------------------------------------
+# Description:  run start offsets of a log file, oldest first
+#   a run starts at the line in front of the banner (the myTime line). The
+#   index is rebuilt when the log shrank or its first bytes changed. A line
+#   still being written (no newline yet) is left for the next call.
+#-------------------------------------------------------------------------------
+def log_index(path):
+    idx_path = path + IDX_SUFFIX
+    try:
+        with open(idx_path) as f:
+            idx = json.load(f)
+    except (IOError, ValueError):
+        idx = {}
+
+    with open(path, 'rb') as f:
+        head = f.read(IDX_HEAD).decode('latin-1')
+        f.seek(0, 2)
+        size = f.tell()
+
+        if not head.startswith(idx.get('head', '\0')) or idx.get('size', 0) > size:
+            idx = {'size': 0, 'prev': 0, 'runs': []}
+        if idx['size'] == size:
+            return idx['runs']
+
+        pos = idx['size']
+        prev = idx['prev']
+        f.seek(pos)
+        for line in f:
+            if not line.endswith(b'\n'):
+                break
+            if LOG_BANNER in line:
+                idx['runs'].append(prev)
+            prev = pos
+            pos += len(line)
+
+    idx.update(size=pos, prev=prev, head=head)
+    p_idx_save(idx_path, idx)
+
+    return idx['runs']
+
+
+#-------------------------------------------------------------------------------
+# Description:  copy run number run (-1 = latest) of a log to out_path
+#   a log without a banner counts as one run
+#-------------------------------------------------------------------------------
+def log_run_extract(path, run, out_path):
+    starts = log_index(path) or [0]
+    i = run if run >= 0 else len(starts) + run
+    if not 0 <= i < len(starts):
+        raise ValueError('{} has {} runs, no run {}'.format(path, len(starts), run))
+
+    end = starts[i + 1] if i + 1 < len(starts) else None
+    with open(path, 'rb') as f, open(out_path, 'wb') as out:
+        f.seek(starts[i])
+        remaining = None if end is None else end - starts[i]
+        while remaining is None or remaining > 0:
+            data = f.read(COPY_CHUNK if remaining is None else min(COPY_CHUNK, remaining))
+            if not data:
+                break
+            out.write(data)
+            if remaining is not None:
+                remaining -= len(data)
+
+    return i
+
+
+#-------------------------------------------------------------------------------
+# Description:  compressed segments
+#   comp        'gz', or 'zst' when the zstandard package is installed
+#-------------------------------------------------------------------------------
+def p_segment_open(path, comp):
+    if comp == 'zst':
+        try:
+            import zstandard
+            return path + '.zst', zstandard.ZstdCompressor().stream_writer(open(path + '.zst', 'wb'))
+        except ImportError:
+            pass    # gzip is always there
+
+    return path + '.gz', gzip.open(path + '.gz', 'wb')
+
+
+# compress a closed file into the archive, delete it and its run index
+def p_archive_file(path, log_dir, comp):
+    st = os.stat(path)
+    month = time.strftime('%Y-%m', time.localtime(st.st_mtime))
+    seg_dir = os.path.join(log_dir, ARCHIVE_DIR, month)
+    if not os.path.isdir(seg_dir):
+        os.makedirs(seg_dir)
+
+    name = os.path.basename(path)
+    seg_path, out = p_segment_open(os.path.join(seg_dir, name + '.' + time.strftime(
+        '%Y%m%d-%H%M%S', time.localtime(st.st_mtime))), comp)
+    with open(path, 'rb') as f, out:
+        while True:
+            data = f.read(COPY_CHUNK)
+            if not data:
+                break
+            out.write(data)
+
+    rec = {'file': name, 'segment': os.path.relpath(seg_path, os.path.join(log_dir, ARCHIVE_DIR)),
+           'bytes': st.st_size, 'mtime': st.st_mtime, 'time': time.time()}
+    with open(os.path.join(log_dir, ARCHIVE_DIR, ARCHIVE_MANIFEST), 'a') as f:
+        f.write(json.dumps(rec, sort_keys=True) + '\n')
+
+    os.remove(path)
+    if os.path.exists(path + IDX_SUFFIX):
+        os.remove(path + IDX_SUFFIX)
+
+    return rec
+
+
+def p_archive_lock(path):
+    for retry in range(2):
+        try:
+            os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return True
+        except OSError:
+            try:
+                if time.time() - os.path.getmtime(path) < ARCHIVE_LOCK_STALE:
+                    return False
+                os.remove(path)
+            except OSError:
+                pass
+
+    return False
+
+
+#-------------------------------------------------------------------------------
+# Description:  close a board log before a new run is appended
+#   returns the manifest record, None if the log stays open
+#-------------------------------------------------------------------------------
+def log_rotate(path, log_dir='.', comp='gz'):
+    if not os.path.exists(path):
+        return None
+    if os.path.getsize(path) < LOG_ROTATE_SIZE and len(log_index(path)) < LOG_ROTATE_RUNS:
+        return None
+
+    return p_archive_file(path, log_dir, comp)
+
+
+#-------------------------------------------------------------------------------
+# Description:  archive idle board files and prune old segments
+#   runs at most every ARCHIVE_SWEEP_HOURS unless forced; parallel fixtures
+#   are kept apart by a lock file, a locked sweep is skipped
+#-------------------------------------------------------------------------------
+def archive_sweep(log_dir='.', comp='gz', f_force=False):
+    arc_dir = os.path.join(log_dir, ARCHIVE_DIR)
+    stamp = os.path.join(arc_dir, '.sweep')
+    if not os.path.isdir(arc_dir):
+        os.makedirs(arc_dir)
+    if not f_force and os.path.exists(stamp) and \
+            time.time() - os.path.getmtime(stamp) < ARCHIVE_SWEEP_HOURS * 3600:
+        return 0
+
+    lock = os.path.join(arc_dir, '.lock')
+    if not p_archive_lock(lock):
+        return 0
+
+    cnt = 0
+    try:
+        t_idle = time.time() - ARCHIVE_IDLE_DAYS * 86400
+        for entry in os.scandir(log_dir):
+            if entry.is_file() and any(entry.name.endswith(s) for s in ARCHIVE_SUFFIXES) \
+                    and entry.stat().st_mtime < t_idle:
+                p_archive_file(entry.path, log_dir, comp)
+                cnt += 1
+
+        cnt += p_archive_prune(arc_dir, time.time() - ARCHIVE_MAX_DAYS * 86400)
+
+        with open(stamp, 'w'):
+            pass
+    finally:
+        os.remove(lock)
+
+    return cnt
+
+
+def p_archive_prune(arc_dir, t_oldest):
+    manifest = os.path.join(arc_dir, ARCHIVE_MANIFEST)
+    keep, cnt = [], 0
+    try:
+        with open(manifest) as f:
+            lines = f.readlines()
+    except IOError:
+        return 0
+
+    for line in lines:
+        try:
+            rec = json.loads(line)
+        except ValueError:
+            continue
+        if rec['mtime'] >= t_oldest:
+            keep.append(line)
+            continue
+        seg_path = os.path.join(arc_dir, rec['segment'])
+        if os.path.exists(seg_path):
+            os.remove(seg_path)
+        cnt += 1
+        try:
+            os.rmdir(os.path.dirname(seg_path))     # only once empty
+        except OSError:
+            pass
+
+    if cnt:
+        with open(manifest + '.tmp', 'w') as f:
+            f.writelines(keep)
+        os.replace(manifest + '.tmp', manifest)
+
+    return cnt
+
+
+# manifest records of the archived files of one board serial, transcripts
+# carry the time and test item between serial and suffix
+def archive_find(serial, log_dir='.'):
+    try:
+        with open(os.path.join(log_dir, ARCHIVE_DIR, ARCHIVE_MANIFEST)) as f:
+            lines = f.readlines()
+    except IOError:
+        return []
+
+    pattern = re.compile(re.escape(serial) + r'(_\d{8}-\d{6}_\w+)?(' +
+                         '|'.join(re.escape(s) for s in ARCHIVE_SUFFIXES) + ')$')
+    recs = []
+    for line in lines:
+        try:
+            rec = json.loads(line)
+        except ValueError:
+            continue
+        if pattern.match(rec['file']):
+            recs.append(rec)
+
+    return recs
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='list or extract the runs of an ICT log')
+    parser.add_argument('log', nargs='?')
+    parser.add_argument('--run', type=int, help='run number, -1 = latest')
+    parser.add_argument('--out', help='file for the extracted run')
+    parser.add_argument('--dir', default='.', help='log directory for --find / --sweep')
+    parser.add_argument('--find', help='board serial, list its archived segments')
+    parser.add_argument('--sweep', action='store_true', help='archive sweep now')
+    args = parser.parse_args()
+
+    if args.find:
+        for rec in archive_find(args.find, args.dir):
+            print('{}  {:12d}  {}'.format(time.strftime('%Y-%m-%d %H:%M', time.localtime(rec['mtime'])),
+                                          rec['bytes'], os.path.join(args.dir, ARCHIVE_DIR, rec['segment'])))
+    elif args.sweep:
+        print(archive_sweep(args.dir, f_force=True), 'files archived or pruned')
+    elif not args.log:
+        parser.error('log file, --find or --sweep needed')
+    elif args.run is None:
+        with open(args.log, 'rb') as f:
+            for i, start in enumerate(log_index(args.log)):
+                f.seek(start)
+                print('{:5d} {:12d}  {}'.format(i, start, f.readline().decode('latin-1').strip()))
+    elif args.out:
+        log_run_extract(args.log, args.run, args.out)
+    else:
+        sys.exit('--out is needed with --run')
@@ -0,0 +1,91 @@
+#-------------------------------------------------------------------------------
+# Name:        picb_parse
+# Purpose:     PICB cmd/debug port response parsing for the ICT script
+#
+#   Every response is scanned once with a precompiled pattern and returned as
+#   a record, so callers no longer run findall several times on the same text
+#   or slice the matches with fixed offsets.
+#
+#-------------------------------------------------------------------------------
+import re
+from collections import namedtuple
+
+
+# NOISE:  'LLS Noise 12 Min 2031 Avg 2048 Max 2066'
+#   noise/min are None unless 'LLS Noise' was found exactly once,
+#   avg/max are None unless 'Avg' was found exactly once
+LlsNoise = namedtuple('LlsNoise', 'noise min avg max')
+
+# VER:    'Ver FW:5.1.2 FPGA:3.0'
+BoardVer = namedtuple('BoardVer', 'fw fpga')
+
+# MCUID:  'MCU ID 0x451, Rev 0x1001, SERNUM 0x0123456789ABCDEF'
+
+
+RE_NOISE = re.compile(r'LLS Noise (\d+) Min(?: (\d+))?|Avg (\d+) Max(?: (\d+))?')
+RE_DIOG  = re.compile(r'Bit (\d+) Value (\d)')
+RE_VER   = re.compile(r'Ver (FW:[\d.]+) (FPGA:[\d.]+)')
+RE_SERNUM = re.compile(r'SERNUM\s+(\w+)')
+
+
+def p_int(s):
+    return None if s is None else int(s)
+
+
+#-------------------------------------------------------------------------------
+# Description:  NOISE response -> LlsNoise
+#-------------------------------------------------------------------------------
+def parse_noise(temp):
+    noise = n_min = avg = n_max = None
+    cnt_noise = cnt_avg = 0
+
+    for m in RE_NOISE.finditer(temp or ''):
+        if m.group(1) is not None:
+            cnt_noise += 1
+            noise, n_min = p_int(m.group(1)), p_int(m.group(2))
+        else:
+            cnt_avg += 1
+            avg, n_max = p_int(m.group(3)), p_int(m.group(4))
+
+    if cnt_noise != 1:
+        noise = n_min = None
+    if cnt_avg != 1:
+        avg = n_max = None
+
+    return LlsNoise(noise, n_min, avg, n_max)
+
+
+#-------------------------------------------------------------------------------
+# Description:  DIOG response -> {bit: value}
+#   a bit reported more than once maps to None
+#-------------------------------------------------------------------------------
+def parse_diog(rtn):
+    bits = {}
+
+    for m in RE_DIOG.finditer(rtn or ''):
+        bit = int(m.group(1))
+        bits[bit] = None if bit in bits else int(m.group(2))
+
+    return bits
+
+
+#-------------------------------------------------------------------------------
+# Description:  VER response -> BoardVer, None if no version banner found
+#-------------------------------------------------------------------------------
+def parse_ver(temp):
+    m = RE_VER.search(temp or '')
+    if m is None:
+        return None
+
+    return BoardVer(m.group(1), m.group(2))
+
+
+#-------------------------------------------------------------------------------
+# Description:  MCUID response -> MCU serial number, None if not found
+#-------------------------------------------------------------------------------
+def parse_mcu_serial(temp):
+    m = RE_SERNUM.search(temp or '')
+    if m is None:
+        return None
+
+    return m.group(1)
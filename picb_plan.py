@@ -0,0 +1,133 @@
+#-------------------------------------------------------------------------------
+# Name:        picb_plan
+# Purpose:     test plan loader for the ICT script
+#
+#   picb_plan.json describes the sequence steps, their parameters, limits and
+#   dependencies. plan_compile() reads it once: constant expressions and the
+#   expected supply readings are evaluated, and the steps are sorted into
+#   dependency levels. Steps of one level do not depend on each other and can
+#   be run in any order.
+#
+#   Expressions are plain arithmetic (+ - * / and brackets) on numbers and
+#   the names defined in 'constants', e.g. "1.37/(1.37+5.23)*DAC_PER_VOLT12".
+#
+#-------------------------------------------------------------------------------
+import ast
+import json
+import hashlib
+import operator
+
+
+PLAN_OPS = {ast.Add: operator.add, ast.Sub: operator.sub,
+            ast.Mult: operator.mul, ast.Div: operator.truediv,
+            ast.USub: operator.neg, ast.UAdd: operator.pos}
+
+# board dict defaults for the fixtures listed in the plan
+PLAN_BOARD = {'cmdHandle': None, 'debugHandle': None,
+              'cmdPort': 50002, 'debugPort': 50001, 'prompt': ''}
+
+
+#-------------------------------------------------------------------------------
+# Description:  number or arithmetic expression -> float
+#-------------------------------------------------------------------------------
+def plan_eval(expr, consts):
+    if not isinstance(expr, str):
+        return float(expr)
+
+    def p_node(node):
+        if isinstance(node, ast.Expression):
+            return p_node(node.body)
+        if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)):
+            return node.value
+        if isinstance(node, ast.Name) and node.id in consts:
+            return consts[node.id]
+        if isinstance(node, ast.BinOp) and type(node.op) in PLAN_OPS:
+            return PLAN_OPS[type(node.op)](p_node(node.left), p_node(node.right))
+        if isinstance(node, ast.UnaryOp) and type(node.op) in PLAN_OPS:
+            return PLAN_OPS[type(node.op)](p_node(node.operand))
+        raise ValueError('invalid expression ' + repr(expr))
+
+    try:
+        return float(p_node(ast.parse(expr, mode='eval')))
+    except SyntaxError:
+        raise ValueError('invalid expression ' + repr(expr))
+
+
+#-------------------------------------------------------------------------------
+# Description:  steps -> dependency levels
+#   returns the steps as (name, func, args, group, level) tuples, level by
+#   level and in plan order inside a level, and the list of levels
+#-------------------------------------------------------------------------------
+def p_plan_levels(steps, funcs):
+    by_name = {}
+    for step in steps:
+        if step['name'] in by_name:
+            raise ValueError('step ' + step['name'] + ' defined twice')
+        if step['func'] not in funcs:
+            raise ValueError('step ' + step['name'] + ': unknown function ' + step['func'])
+        by_name[step['name']] = step
+
+    for step in steps:
+        for dep in step.get('deps', []):
+            if dep not in by_name:
+                raise ValueError('step ' + step['name'] + ': unknown dependency ' + dep)
+
+    level = {}
+    levels = []
+    remaining = [step['name'] for step in steps]
+    while remaining:
+        ready = [n for n in remaining if all(d in level for d in by_name[n].get('deps', []))]
+        if not ready:
+            raise ValueError('dependency loop in ' + ', '.join(remaining))
+        for n in ready:
+            level[n] = len(levels)
+        levels.append(ready)
+        remaining = [n for n in remaining if n not in level]
+
+    group_level = {}
+    for step in steps:
+        group = step.get('group', step['name'])
+        if group_level.setdefault(group, level[step['name']]) != level[step['name']]:
+            raise ValueError('group ' + group + ' spans dependency levels')
+
+    compiled = []
+    for names in levels:
+        for n in names:
+            step = by_name[n]
+            compiled.append((n, step['func'], tuple(step.get('args', [])),
+                             step.get('group', n), level[n]))
+
+    return compiled, levels
+
+
+#-------------------------------------------------------------------------------
+# Description:  load and compile the plan file
+#   funcs       names of the functions a step may call
+#   raises IOError / ValueError / KeyError on a bad plan
+#   'sha256' of the file lets a checkpoint tell a changed plan
+#-------------------------------------------------------------------------------
+def plan_compile(path, funcs):
+    with open(path, 'rb') as f:
+        text = f.read()
+    plan = json.loads(text.decode('utf-8'))
+
+    consts = {}
+    for key, expr in plan.get('constants', {}).items():
+        consts[key] = plan_eval(expr, consts)
+
+    supply = []
+    for rec in plan['supply']:
+        scale = plan_eval(rec['scale'], consts)
+        supply.append(dict(rec, scale=scale, typ=rec['volt'] * scale,
+                           check=rec.get('check', True)))
+
+    steps, levels = p_plan_levels(plan['steps'], funcs)
+
+    return {'consts':   consts,
+            'limits':   plan['limits'],
+            'supply':   supply,
+            'pm':       plan['pressure_sensor'],
+            'steps':    steps,
+            'levels':   levels,
+            'boards':   [dict(PLAN_BOARD, **b) for b in plan.get('boards', [])],
+            'sha256':   hashlib.sha256(text).hexdigest()}
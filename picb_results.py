@@ -0,0 +1,140 @@
+#-------------------------------------------------------------------------------
+# Name:        picb_results
+# Purpose:     SQLite results store for the ICT script
+#
+#   Every analog measurement of a test run goes into one 'measurement' row
+#   together with the board, fixture IP, run and script version. Rows are
+#   buffered and written with one executemany per batch; ict_picb.py flushes
+#   after every sequence step and when the ports are closed.
+#
+#   lo / hi are the limits of the checked value: ADC counts for 'supply',
+#   volts for 'pm', avg for the LLS tests; noise_max applies to noise.
+#   result is 1 / 0 for a reading with a limit check, NULL otherwise.
+#
+#   python picb_results.py log/picb_results.db [--board SN] [--test lls]
+#       writes the matching rows as CSV to stdout
+#
+#-------------------------------------------------------------------------------
+import sys
+import csv
+import time
+import sqlite3
+import argparse
+
+
+RESULTS_BATCH   = 500       # rows buffered before an insert
+RESULTS_TIMEOUT = 30.0      # seconds to wait for another fixture's write lock
+
+RESULTS_META    = ['run', 'board', 'ip', 'script_ver']
+RESULTS_COLS    = ['test', 'name', 'cond', 'ch', 'freq', 'gain_in', 'gain_out',
+                   'noise', 'avg', 'adc', 'volt', 'lo', 'hi', 'noise_max', 'result']
+
+RESULTS_SCHEMA  = """
+CREATE TABLE IF NOT EXISTS measurement (
+    id          INTEGER PRIMARY KEY,
+    run         TEXT,
+    board       TEXT,
+    ip          TEXT,
+    script_ver  TEXT,
+    ts          REAL,
+    test        TEXT,
+    name        TEXT,
+    cond        TEXT,
+    ch          INTEGER,
+    freq        INTEGER,
+    gain_in     INTEGER,
+    gain_out    INTEGER,
+    noise       INTEGER,
+    avg         INTEGER,
+    adc         REAL,
+    volt        REAL,
+    lo          REAL,
+    hi          REAL,
+    noise_max   REAL,
+    result      INTEGER
+);
+CREATE INDEX IF NOT EXISTS measurement_board ON measurement (board);
+CREATE INDEX IF NOT EXISTS measurement_test ON measurement (test, ts);
+"""
+
+RESULTS_INSERT  = 'INSERT INTO measurement ({}) VALUES ({})'.format(
+    ', '.join(RESULTS_META + ['ts'] + RESULTS_COLS),
+    ', '.join('?' * (len(RESULTS_META) + 1 + len(RESULTS_COLS))))
+
+
+def results_open(path):
+    db = sqlite3.connect(path, timeout=RESULTS_TIMEOUT)
+    db.execute('PRAGMA journal_mode=WAL')   # fixtures write while others read
+    db.executescript(RESULTS_SCHEMA)
+    return db
+
+
+# numpy scalars and bools -> plain SQLite values
+def p_sql(value):
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, float):
+        return float(value)
+    if isinstance(value, int):
+        return int(value)
+    return value.item()
+
+
+#-------------------------------------------------------------------------------
+# Description:  buffered measurement writer, one per board
+#   meta        {'run', 'board', 'ip', 'script_ver'} stored with every row
+#-------------------------------------------------------------------------------
+class ResultStore(object):
+
+    def __init__(self, path, meta):
+        self.path = path
+        self.meta = tuple(meta[k] for k in RESULTS_META)
+        self.rows = []
+        self.db = None
+
+    def add(self, test, **fields):
+        unknown = set(fields) - set(RESULTS_COLS)
+        if unknown:
+            raise TypeError('unknown result fields ' + ', '.join(sorted(unknown)))
+
+        self.rows.append(self.meta + (time.time(), test) +
+                         tuple(p_sql(fields.get(c)) for c in RESULTS_COLS[1:]))
+        if len(self.rows) >= RESULTS_BATCH:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        if self.db is None:
+            self.db = results_open(self.path)
+        with self.db:
+            self.db.executemany(RESULTS_INSERT, self.rows)
+        self.rows = []
+
+    def close(self):
+        self.flush()
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='export ICT measurements as CSV')
+    parser.add_argument('db')
+    parser.add_argument('--board', help='board serial (log file name)')
+    parser.add_argument('--test', help='supply, pm, lls, lls_ground, lls_debug')
+    args = parser.parse_args()
+
+    where, params = [], []
+    for col in ['board', 'test']:
+        if getattr(args, col):
+            where.append(col + ' = ?')
+            params.append(getattr(args, col))
+    sql = 'SELECT * FROM measurement'
+    if where:
+        sql += ' WHERE ' + ' AND '.join(where)
+
+    cur = results_open(args.db).execute(sql + ' ORDER BY id', params)
+    out = csv.writer(sys.stdout, lineterminator='\n')
+    out.writerow([d[0] for d in cur.description])
+    out.writerows(cur)
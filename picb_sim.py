@@ -0,0 +1,401 @@
+#-------------------------------------------------------------------------------
+# Name:        picb_sim
+# Purpose:     local PICB board stand-in speaking the cmd/debug port protocol
+#
+#   Listens on a cmd port (50002) and a debug port (50001) like the board and
+#   answers the commands used by ict_picb.py. Every command line (terminated
+#   by CR or LF) gets its reply text on the cmd port followed by CMD_EOL and
+#   the prompt; the same text is written to every debug port client.
+#
+#   Values follow the nominal fixture readings and can be changed per board,
+#   see SIM_DEFAULT. Latency and faults are injected per command.
+#
+#   SIMBOOT <app|bl> is simulator only: reboots into the given mode, used by
+#   harnesses in place of programming_MCU_exe.
+#
+#   python picb_sim.py [--latency s] [--board host:cmdPort:debugPort ...]
+#
+#-------------------------------------------------------------------------------
+import sys
+import math
+import time
+import random
+import socket
+import argparse
+import threading
+import socketserver
+
+
+CMD_EOL     = '\r\n'
+
+
+# nominal readings of a good board in the ICT fixture
+SIM_DEFAULT = {
+    'fw_ver':       'FW:5.1.2',
+    'bl_ver':       'FW:3.5.0',
+    'fpga_ver':     'FPGA:3.0',
+    'board_id':     '0',
+    'board_rev':    'Board Rev 2, Part num 0, Dash num 0',
+    'mcu_id':       'MCU ID 0x451, Rev 0x1001, SERNUM 0x0123456789ABCDEF',
+    'prompt':       '>',
+    'mode':         'app',      # 'app' or 'bl'
+    'reboot_time':  2.0,        # seconds the ports are down after RBL / reboot()
+
+    # AIN_read, raw >> 2 of VMON_12V_MINUS ... VMON_PM_BIAS
+    'ain':          [763, 775, 310, 310, 772, 774, 769],
+    'ain_noise':    1.0,
+
+    # U61 MUX input volts [PM_IN, PM_VAC_IN, A2D_REF3.0V, 1_5VOLT_BIAS],
+    # index by DIOS 768: 0 relay open (8R), 1 relay closed (4R)
+    'pm_volt':      [[0.883, 2.747, 0.748, 1.5], [0.815, 2.124, 0.748, 1.5]],
+    'pm_noise':     0.0005,
+
+    # LLS Avg = 4095 * (1 - exp(-gain_in*gain_out*lls_gain[ch] / lls_g0))
+    'lls_g0':       2000.0,
+    'lls_gain':     [1.0, 1.0, 1.0, 1.0, 2.2, 1.0],
+    'lls_ground':   200,        # Avg with the LLS output grounded
+    'lls_noise':    10,
+
+    'settle_tau':   0.005,      # analog time constant after a state change
+
+    # latency and faults, per command
+    'latency':      0.0,        # seconds before the reply
+    'jitter':       0.0,        # extra uniform random latency
+    'drop':         0.0,        # probability of no reply at all
+    'garble':       0.0,        # probability of digits replaced in the reply
+    'disconnect':   0.0,        # probability of the cmd connection dropped
+    'dead_lls':     [],         # LLS channels reading 0
+}
+
+
+#-------------------------------------------------------------------------------
+# Description:  one simulated board, state and command handling
+#-------------------------------------------------------------------------------
+class SimBoard(object):
+
+    def __init__(self, host='127.0.0.1', cmd_port=50002, debug_port=50001, **cfg):
+        self.host = host
+        self.cmd_port = cmd_port
+        self.debug_port = debug_port
+        self.cfg = dict(SIM_DEFAULT)
+        self.cfg.update(cfg)
+
+        self.lock = threading.RLock()
+        self.servers = []
+        self.clients = []
+        self.debug_clients = []
+        self.cmd_count = 0
+        self.state_reset()
+
+    def state_reset(self):
+        self.dios = {}
+        self.smux = 0
+        self.sgain = (9, 9)
+        self.sfreq = 100
+        self.sphase = 0
+        self.en = 0
+        self.stl = '1 1 1 1 1 1 1 1'
+        self.szl = '1 1 1 1 1 1 1 1 1 1'
+        self.toggle = {}
+        self.analog = {}
+
+    #---------------------------------------------------------------------------
+    # servers
+    #---------------------------------------------------------------------------
+    def start(self):
+        board = self
+
+        class CmdHandler(socketserver.BaseRequestHandler):
+            def handle(self):
+                self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                board.p_cmd_client(self.request)
+
+        class DebugHandler(socketserver.BaseRequestHandler):
+            def handle(self):
+                board.p_debug_client(self.request)
+
+        for port, handler in [(self.cmd_port, CmdHandler), (self.debug_port, DebugHandler)]:
+            server = socketserver.ThreadingTCPServer((self.host, port), handler, bind_and_activate=False)
+            server.allow_reuse_address = True
+            server.daemon_threads = True
+            server.server_bind()
+            server.server_activate()
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            self.servers.append(server)
+
+        return self
+
+    def stop(self):
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+        self.servers = []
+
+        with self.lock:
+            for conn in self.clients + self.debug_clients:
+                try:
+                    conn.shutdown(socket.SHUT_RDWR)
+                    conn.close()
+                except socket.error:
+                    pass
+            self.clients = []
+            self.debug_clients = []
+
+    # ports down for reboot_time, then back up in the given mode
+    def reboot(self, mode='app'):
+        def p_reboot():
+            self.stop()
+            time.sleep(self.cfg['reboot_time'])
+            with self.lock:
+                self.cfg['mode'] = mode
+                self.state_reset()
+            self.start()
+
+        threading.Thread(target=p_reboot, daemon=True).start()
+
+    def p_cmd_client(self, conn):
+        with self.lock:
+            self.clients.append(conn)
+
+        buf = ''
+        try:
+            while True:
+                data = conn.recv(4096)
+                if not data:
+                    break
+                buf += data.decode('ascii', 'replace').replace('\r', '\n')
+                while '\n' in buf:
+                    line, buf = buf.split('\n', 1)
+                    if line.strip() and not self.p_cmd_line(conn, line.strip()):
+                        return
+        except socket.error:
+            pass
+        finally:
+            with self.lock:
+                if conn in self.clients:
+                    self.clients.remove(conn)
+
+    def p_debug_client(self, conn):
+        with self.lock:
+            self.debug_clients.append(conn)
+        try:
+            while conn.recv(4096):
+                pass
+        except socket.error:
+            pass
+        finally:
+            with self.lock:
+                if conn in self.debug_clients:
+                    self.debug_clients.remove(conn)
+
+    # returns False when the connection was dropped
+    def p_cmd_line(self, conn, line):
+        cfg = self.cfg
+        time.sleep(cfg['latency'] + random.uniform(0, cfg['jitter']))
+
+        if random.random() < cfg['disconnect']:
+            conn.close()
+            return False
+
+        with self.lock:
+            self.cmd_count += 1
+            rtn = self.command(line)
+
+        if random.random() < cfg['drop']:
+            return True
+        if random.random() < cfg['garble']:
+            rtn = ''.join(random.choice('0123456789') if c.isdigit() else c for c in rtn)
+
+        self.p_debug_write(rtn + CMD_EOL)
+        conn.sendall((rtn + CMD_EOL + cfg['prompt']).encode())
+
+        word = line.upper().split()
+        if word[0] == 'RBL':
+            self.reboot('bl')
+        elif word[0] == 'SIMBOOT':
+            self.reboot('bl' if word[1:] == ['BL'] else 'app')
+
+        return True
+
+    def p_debug_write(self, text):
+        with self.lock:
+            for conn in list(self.debug_clients):
+                try:
+                    conn.sendall(text.encode())
+                except socket.error:
+                    self.debug_clients.remove(conn)
+
+    #---------------------------------------------------------------------------
+    # command handling, returns the reply text
+    #---------------------------------------------------------------------------
+    def command(self, line):
+        word = line.split()
+        cmd = word[0].upper()
+        arg = word[1:]
+        cfg = self.cfg
+
+        if cmd == 'VER':
+            fw = cfg['fw_ver'] if cfg['mode'] == 'app' else cfg['bl_ver']
+            return 'Ver ' + fw + ' ' + cfg['fpga_ver']
+        if cmd == 'BDID':
+            return 'Board ID ' + (cfg['board_id'] if cfg['mode'] == 'app' else '0')
+        if cmd == 'BDT':
+            return 'Board Type IA'
+        if cmd in ['REV', 'BDREV']:
+            return cfg['board_rev']
+        if cmd == 'MCUID':
+            return cfg['mcu_id']
+        if cmd == 'DGC':
+            return '0, 0, 0, 0, 0, 0, 0 No Faults #0'
+        if cmd == 'RBL':
+            return 'Rebooting to bootloader'
+        if cmd == 'SIMBOOT':
+            return 'Rebooting'
+
+        if cmd == 'DIOS':
+            self.p_changed()
+            self.dios[int(arg[0])] = int(arg[1])
+            return 'DIOS ' + arg[0] + ' ' + arg[1]
+        if cmd == 'DIOG':
+            bit = int(arg[0])
+            return 'Bit {} Value {}'.format(bit, self.p_dio_in(bit))
+        if cmd == 'STL':
+            self.stl = ' '.join(arg)
+            return 'STL ' + self.stl
+        if cmd == 'SZL':
+            self.szl = ' '.join(arg)
+            return 'SZL ' + self.szl
+
+        if cmd == 'SMUX':
+            self.p_changed()
+            self.smux = int(arg[0])
+            return 'SMUX ' + arg[0]
+        if cmd in ['R16', 'RD16']:
+            return '0x{:04X}'.format(self.r16(int(arg[0], 0)))
+        if cmd == 'AIN':
+            return 'AIN {} {}'.format(arg[0], self.ain(int(arg[0])))
+
+        if cmd == 'SGAIN':
+            self.p_changed()
+            self.sgain = (int(arg[0]), int(arg[1]))
+            return 'LLS SET Gain {} {}'.format(*self.sgain)
+        if cmd == 'SFREQ':
+            self.sfreq = int(arg[0])
+            return 'LLS SET Freq {}'.format(self.sfreq)
+        if cmd == 'GFREQ':
+            return 'LLS GET Freq {}'.format(self.sfreq)
+        if cmd == 'SPHASE':
+            self.sphase = int(arg[0])
+            return 'LLS SET Phase {}'.format(self.sphase)
+        if cmd == 'GPHASE':
+            return 'LLS GET Phase {}'.format(self.sphase)
+        if cmd == 'EN':
+            self.p_changed()
+            self.en = int(arg[0])
+            return 'LLS EN {}'.format(self.en)
+        if cmd == 'NOISE':
+            avg = int(round(self.p_settled('lls', self.lls_avg())))
+            n = random.randint(0, cfg['lls_noise'])
+            return 'LLS Noise {} Min {} Avg {} Max {}'.format(
+                n, max(avg - n, 0), avg, min(avg + n, 4095))
+
+        return 'ERR unknown command ' + cmd
+
+    def p_dio_in(self, bit):
+        if bit == 4:
+            # crsh_in follows crsh_sensor_en_b inverted
+            return 1 - self.dios.get(768, 0)
+        if bit == 0:
+            # any asserted opto-coupler output pulls GPIO 0 high
+            return 1 if '0' in (self.stl + ' ' + self.szl).split() else 0
+        if bit in [1, 6, 7]:
+            # RS485 outputs toggling, level changes every 3 reads
+            cnt = self.toggle.get(bit, 0)
+            self.toggle[bit] = cnt + 1
+            return (cnt // 3) % 2
+        return 0
+
+    def ain(self, ch):
+        return int(round(self.cfg['ain'][ch] + random.gauss(0, self.cfg['ain_noise'])))
+
+    def r16(self, addr):
+        if addr != 0x60006000:
+            return 0
+        volt = self.cfg['pm_volt'][self.dios.get(768, 0)][self.smux]
+        volt = self.p_settled('pm', volt) + random.gauss(0, self.cfg['pm_noise'])
+        return max(0, min(0xFFFF, int(volt / 3.0 * 65536)))
+
+    def lls_avg(self):
+        cfg = self.cfg
+        if self.en in cfg['dead_lls']:
+            return 0
+        if self.dios.get(768, 0) == 1:
+            return cfg['lls_ground']
+        g = self.sgain[0] * self.sgain[1] * cfg['lls_gain'][self.en]
+        return 4095.0 * (1.0 - math.exp(-g / cfg['lls_g0']))
+
+    # first-order settling of the analog readings after a state change
+    def p_changed(self):
+        now = time.time()
+        for key, (start, target, t0) in list(self.analog.items()):
+            self.analog[key] = (self.p_value(start, target, t0, now), None, now)
+
+    def p_settled(self, key, target):
+        now = time.time()
+        start, old_target, t0 = self.analog.get(key, (target, target, now))
+        if old_target is not None and old_target != target:
+            start, t0 = self.p_value(start, old_target, t0, now), now
+        value = self.p_value(start, target, t0, now)
+        self.analog[key] = (start, target, t0)
+        return value
+
+    def p_value(self, start, target, t0, now):
+        if target is None:
+            return start
+        tau = self.cfg['settle_tau']
+        if tau <= 0:
+            return target
+        return target + (start - target) * math.exp(-(now - t0) / tau)
+
+
+#-------------------------------------------------------------------------------
+# Description:  start one simulated board per (host, cmdPort, debugPort)
+#-------------------------------------------------------------------------------
+def sim_start(boards, **cfg):
+    return [SimBoard(host, cmd_port, debug_port, **cfg).start()
+            for host, cmd_port, debug_port in boards]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='PICB board simulator')
+    parser.add_argument('--board', action='append', default=[],
+                        help='host:cmdPort:debugPort, repeat for several boards')
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--drop', type=float, default=0.0)
+    parser.add_argument('--garble', type=float, default=0.0)
+    parser.add_argument('--disconnect', type=float, default=0.0)
+    parser.add_argument('--dead-lls', type=int, action='append', default=[])
+    parser.add_argument('--mode', choices=['app', 'bl'], default='app')
+    parser.add_argument('--reboot-time', type=float, default=SIM_DEFAULT['reboot_time'])
+    args = parser.parse_args()
+
+    boards = []
+    for item in args.board or ['127.0.0.1:50002:50001']:
+        host, cmd_port, debug_port = item.split(':')
+        boards.append((host, int(cmd_port), int(debug_port)))
+
+    sims = sim_start(boards, latency=args.latency, jitter=args.jitter,
+                     drop=args.drop, garble=args.garble,
+                     disconnect=args.disconnect, dead_lls=args.dead_lls,
+                     mode=args.mode, reboot_time=args.reboot_time)
+    for sim in sims:
+        print('PICB sim {} cmd {} debug {}'.format(sim.host, sim.cmd_port, sim.debug_port))
+
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        for sim in sims:
+            sim.stop()
+        sys.exit()
@@ -0,0 +1,55 @@
+#-------------------------------------------------------------------------------
+# Name:        conftest
+# Purpose:     pytest fixtures for the ICT script modules
+#
+#   The modules are plain scripts next to this directory, so the repository
+#   root goes on sys.path. Tests of ict_picb.py need the station's my_ict
+#   module and are skipped without it.
+#
+#   python -m pytest tests
+#
+#-------------------------------------------------------------------------------
+import os
+import sys
+import socket
+
+import pytest
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def p_free_port():
+    s = socket.socket()
+    s.bind(('127.0.0.1', 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+
+# ict_picb imported as a launch of test item 3 of board 'SN' in tmp_path
+@pytest.fixture
+def ict(tmp_path, monkeypatch):
+    pytest.importorskip('my_ict')
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(sys, 'argv', ['ict_picb.py', '127.0.0.1', 'SN', '3'])
+    import ict_picb
+    return ict_picb
+
+
+@pytest.fixture
+def sim():
+    import picb_sim
+    board = picb_sim.SimBoard('127.0.0.1', p_free_port(), p_free_port()).start()
+    yield board
+    board.stop()
+
+
+@pytest.fixture
+def board(ict, sim):
+    import picb_bench
+    board = picb_bench.sim_board(sim.cmd_port, sim.debug_port)
+    assert ict.p_ports_open(board)
+    yield board
+    ict.p_ports_close(board)
@@ -0,0 +1,157 @@
+import math
+
+import pytest
+
+
+#-------------------------------------------------------------------------------
+# lls_sweep
+#-------------------------------------------------------------------------------
+def p_sweep(ict, curves, n=10, sat=4000):
+    reads = []
+
+    def read(i):
+        reads.append(i)
+        return [curve(i) for curve in curves]
+
+    idx = ict.lls_sweep(read, n, sat)
+    assert sorted(reads) == idx     # no point read twice
+    return idx
+
+
+def test_sweep_straight_line(ict):
+    assert p_sweep(ict, [lambda i: 100 + 300*i]) == [0, 3, 6, 9]
+
+
+def test_sweep_saturation_found(ict):
+    idx = p_sweep(ict, [lambda i: min(4095, 600*i)])
+    ys = [min(4095, 600*i) for i in idx]
+    # the crossing of sat is read on neighbouring points
+    assert any(a + 1 == b and ys[k] < 4000 <= ys[k+1]
+               for k, (a, b) in enumerate(zip(idx, idx[1:])))
+
+
+def test_sweep_not_rising(ict):
+    # a dip on a coarse point, the interval in front of it is read point by point
+    idx = p_sweep(ict, [lambda i: 100 + 300*i if i != 6 else 0])
+    assert set([3, 4, 5, 6]) <= set(idx)
+
+
+def test_sweep_bend(ict):
+    curve = lambda i: 4095 * (1 - math.exp(-i / 2.0))
+    assert len(p_sweep(ict, [curve], sat=5000)) > 4
+
+
+def test_sweep_missing_reading(ict):
+    assert p_sweep(ict, [lambda i: None]) == [0, 3, 6, 9]
+
+
+#-------------------------------------------------------------------------------
+# p_steps_order
+#-------------------------------------------------------------------------------
+STEPS = [('a', 'PICB_a', (), 'a', 0), ('b1', 'PICB_b', (), 'b', 0),
+         ('b2', 'PICB_b', (), 'b', 0), ('c', 'PICB_c', (), 'c', 0),
+         ('d', 'PICB_d', (), 'd', 1)]
+
+
+def p_names(steps):
+    return [step[0] for step in steps]
+
+
+def test_order_without_history(ict):
+    # every step 50% and HIST_COST, the single steps beat the group
+    assert p_names(ict.p_steps_order(STEPS, {})) == ['a', 'c', 'b1', 'b2', 'd']
+
+
+def test_order_failing_first(ict):
+    hist = {'a': {'runs': 100, 'fails': 0, 'time': 100.0},
+            'c': {'runs': 100, 'fails': 50, 'time': 100.0},
+            'd': {'runs': 100, 'fails': 100, 'time': 1.0}}
+    order = p_names(ict.p_steps_order(STEPS, hist))
+    assert order.index('c') < order.index('a')
+    assert order[-1] == 'd'     # next level, however likely it fails
+    assert order.index('b2') == order.index('b1') + 1
+
+
+def test_order_cheap_first(ict):
+    hist = {'a': {'runs': 10, 'fails': 5, 'time': 100.0},
+            'c': {'runs': 10, 'fails': 5, 'time': 1.0}}
+    order = p_names(ict.p_steps_order(STEPS, hist))
+    assert order.index('c') < order.index('a')
+
+
+def test_order_equal_score(ict):
+    steps = [s for s in STEPS if s[3] != 'b']
+    hist = dict((s[0], {'runs': 5, 'fails': 0, 'time': 0.0}) for s in steps)
+    assert p_names(ict.p_steps_order(steps, hist)) == p_names(steps)
+
+
+#-------------------------------------------------------------------------------
+# state shadow and eth_cmd_batch against picb_sim
+#-------------------------------------------------------------------------------
+def p_sent(sim, func, *args):
+    cnt = sim.cmd_count
+    rtn = func(*args)
+    return rtn, sim.cmd_count - cnt
+
+
+def test_shadow(ict, sim, board):
+    rtn, sent = p_sent(sim, ict.eth_cmd_state, board, 'SMUX 1')
+    assert sent == 1
+    assert p_sent(sim, ict.eth_cmd_state, board, 'SMUX 1') == (rtn, 0)
+    assert p_sent(sim, ict.eth_cmd_state, board, 'SMUX 2')[1] == 1
+    assert p_sent(sim, ict.eth_cmd_state, board, 'DIOS 768 1')[1] == 1
+    assert p_sent(sim, ict.eth_cmd_state, board, 'DIOS 769 1')[1] == 1
+    assert p_sent(sim, ict.eth_cmd_state, board, 'DIOS 768 1')[1] == 0
+
+
+def test_shadow_en_resets_gain(ict, sim, board):
+    ict.eth_cmd_state(board, 'SGAIN 9 9')
+    ict.eth_cmd_state(board, 'EN 1')
+    assert p_sent(sim, ict.eth_cmd_state, board, 'SGAIN 9 9')[1] == 1
+
+
+def test_shadow_dropped_after_reboot(ict, sim, board):
+    ict.eth_cmd_state(board, 'SMUX 1')
+    ict.p_board_rebooted(board)
+    assert p_sent(sim, ict.eth_cmd_state, board, 'SMUX 1')[1] == 1
+
+
+def test_batch(ict, sim, board):
+    cmds = ['SMUX 3', 'DIOG 0', 'SMUX 3', 'BDID']
+    rtn, sent = p_sent(sim, ict.eth_cmd_batch, board, cmds)
+    assert sent == 3
+    assert len(rtn) == 4
+    assert rtn[2] == rtn[0]
+    assert 'Bit 0 Value' in rtn[1]
+    assert rtn == [ict.eth_cmd_write(board, cmd) for cmd in cmds]
+
+    # the shadow answers the state command of the next batch
+    rtn, sent = p_sent(sim, ict.eth_cmd_batch, board, ['SMUX 3', 'DIOG 0'])
+    assert sent == 1
+
+
+def test_batch_without_prompt(ict, sim, board):
+    board['prompt'] = ''
+    rtn, sent = p_sent(sim, ict.eth_cmd_batch, board, ['SMUX 4', 'SMUX 4', 'BDID'])
+    assert sent == 2
+    assert rtn[0] == rtn[1]
+
+
+#-------------------------------------------------------------------------------
+# part 3 end to end against picb_sim
+#-------------------------------------------------------------------------------
+def test_part3(ict, sim, board):
+    assert ict.main_p3(board)
+
+    steps = ict.p_ckpt_load()
+    assert sorted(steps) == sorted(step[0] for step in ict.PICB_STEPS)
+    assert all(rec['pass'] for rec in steps.values())
+
+
+def test_part3_dead_channel(ict, sim, board):
+    sim.cfg['dead_lls'] = [2]
+    assert not ict.main_p3(board)
+
+    steps = ict.p_ckpt_load()
+    assert not steps['lls_ch2']['pass']
+    assert steps['supply_voltage']['pass']
@@ -0,0 +1,104 @@
+import os
+import gzip
+import json
+
+import pytest
+
+import picb_log
+from picb_log import log_index, log_run_extract, log_rotate, archive_find
+
+
+BANNER = '=' * 79 + '\n'
+
+
+def p_run(n):
+    return 'time {}\n'.format(n) + BANNER + 'run {} line\n'.format(n)
+
+
+def p_write(path, text, mode='w'):
+    with open(path, mode, newline='') as f:
+        f.write(text)
+
+
+def test_index(tmp_path):
+    path = str(tmp_path / 'SN_log.txt')
+    p_write(path, p_run(0) + p_run(1))
+    assert log_index(path) == [0, len(p_run(0))]
+    assert os.path.exists(path + '.idx')
+
+
+def test_index_appended(tmp_path):
+    path = str(tmp_path / 'SN_log.txt')
+    p_write(path, p_run(0))
+    assert log_index(path) == [0]
+
+    # a line still being written is not counted yet
+    p_write(path, 'time 1\n' + '=' * 40, 'a')
+    assert log_index(path) == [0]
+
+    p_write(path, '=' * 39 + '\nrun 1 line\n', 'a')
+    assert log_index(path) == [0, len(p_run(0))]
+
+
+def test_index_replaced_log(tmp_path):
+    path = str(tmp_path / 'SN_log.txt')
+    p_write(path, p_run(0) + p_run(1) + p_run(2))
+    assert len(log_index(path)) == 3
+
+    p_write(path, 'other ' + p_run(5))
+    assert log_index(path) == [0]
+
+
+def test_extract(tmp_path):
+    path = str(tmp_path / 'SN_log.txt')
+    out = str(tmp_path / 'run.txt')
+    p_write(path, p_run(0) + p_run(1) + p_run(2))
+
+    assert log_run_extract(path, -1, out) == 2
+    with open(out, newline='') as f:
+        assert f.read() == p_run(2)
+
+    assert log_run_extract(path, 1, out) == 1
+    with open(out, newline='') as f:
+        assert f.read() == p_run(1)
+
+    with pytest.raises(ValueError):
+        log_run_extract(path, 3, out)
+
+
+def test_extract_without_banner(tmp_path):
+    path = str(tmp_path / 'SN_log.txt')
+    out = str(tmp_path / 'run.txt')
+    p_write(path, 'no banner\n')
+
+    assert log_run_extract(path, -1, out) == 0
+    with open(out) as f:
+        assert f.read() == 'no banner\n'
+
+
+def test_rotate(tmp_path, monkeypatch):
+    monkeypatch.setattr(picb_log, 'LOG_ROTATE_RUNS', 3)
+    path = str(tmp_path / 'SN_log.txt')
+    p_write(path, p_run(0) + p_run(1))
+    assert log_rotate(path, str(tmp_path)) is None
+
+    p_write(path, p_run(2), 'a')
+    rec = log_rotate(path, str(tmp_path))
+    assert rec['file'] == 'SN_log.txt'
+    assert not os.path.exists(path) and not os.path.exists(path + '.idx')
+
+    with gzip.open(os.path.join(str(tmp_path), 'archive', rec['segment']), 'rt') as f:
+        assert f.read() == p_run(0) + p_run(1) + p_run(2)
+    assert archive_find('SN', str(tmp_path)) == [rec]
+    assert log_rotate(path, str(tmp_path)) is None
+
+
+def test_archive_find(tmp_path):
+    os.makedirs(str(tmp_path / 'archive'))
+    names = ['SN_log.txt', 'SN_20261018-142024_3_trace.jsonl.gz', 'SN_ckpt.json',
+             'SN2_log.txt', 'SN_x_log.txt', 'SN_LLS.csv.bak']
+    with open(str(tmp_path / 'archive' / 'manifest.jsonl'), 'w') as f:
+        for name in names:
+            f.write(json.dumps({'file': name}) + '\n')
+
+    assert [rec['file'] for rec in archive_find('SN', str(tmp_path))] == names[:3]
@@ -0,0 +1,37 @@
+from picb_parse import LlsNoise, BoardVer, parse_noise, parse_diog, parse_ver, parse_mcu_serial
+
+
+def test_noise():
+    assert parse_noise('LLS Noise 12 Min 2031 Avg 2048 Max 2066\r\n>') == LlsNoise(12, 2031, 2048, 2066)
+
+
+def test_noise_without_min_max():
+    assert parse_noise('LLS Noise 3 Min Avg 4095 Max') == LlsNoise(3, None, 4095, None)
+
+
+def test_noise_twice_is_not_valid():
+    rec = parse_noise('LLS Noise 1 Min 2 Avg 3 Max 4\nLLS Noise 5 Min 6 Avg 7 Max 8')
+    assert rec == LlsNoise(None, None, None, None)
+
+
+def test_noise_missing():
+    assert parse_noise('') == LlsNoise(None, None, None, None)
+    assert parse_noise(None) == LlsNoise(None, None, None, None)
+    assert parse_noise('Avg 100 Max 110') == LlsNoise(None, None, 100, 110)
+
+
+def test_diog():
+    assert parse_diog('Bit 0 Value 1\r\nBit 1 Value 0\r\n') == {0: 1, 1: 0}
+    assert parse_diog('Bit 3 Value 1 Bit 3 Value 1') == {3: None}
+    assert parse_diog(None) == {}
+
+
+def test_ver():
+    assert parse_ver('Ver FW:5.1.2 FPGA:3.0\r\n>') == BoardVer('FW:5.1.2', 'FPGA:3.0')
+    assert parse_ver('Ver FW:5.1.2') is None
+    assert parse_ver(None) is None
+
+
+def test_mcu_serial():
+    assert parse_mcu_serial('MCU ID 0x451, Rev 0x1001, SERNUM 0x0123456789ABCDEF') == '0x0123456789ABCDEF'
+    assert parse_mcu_serial('MCU ID 0x451') is None
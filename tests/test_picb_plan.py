@@ -0,0 +1,82 @@
+import os
+import json
+
+import pytest
+
+from picb_plan import plan_eval, p_plan_levels, plan_compile
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FUNCS = ['PICB_a', 'PICB_b']
+
+
+def p_step(name, deps=(), group=None):
+    step = {'name': name, 'func': 'PICB_a', 'deps': list(deps)}
+    if group is not None:
+        step['group'] = group
+    return step
+
+
+def test_eval():
+    assert plan_eval(3, {}) == 3.0
+    assert plan_eval('1.37/(1.37+5.23)*K', {'K': 4095}) == pytest.approx(1.37/(1.37+5.23)*4095)
+    assert plan_eval('-2*(1+0.5)', {}) == -3.0
+
+
+@pytest.mark.parametrize('expr', ['K', '2**8', 'abs(-1)', '__import__("os")', '1 +', 'a.b', '"x"'])
+def test_eval_bad_expression(expr):
+    with pytest.raises(ValueError):
+        plan_eval(expr, {})
+
+
+def test_levels():
+    steps, levels = p_plan_levels([p_step('a'), p_step('c', ['b']), p_step('b', ['a']),
+                                   p_step('d')], FUNCS)
+    assert levels == [['a', 'd'], ['b'], ['c']]
+    assert [(s[0], s[4]) for s in steps] == [('a', 0), ('d', 0), ('b', 1), ('c', 2)]
+
+
+def test_levels_group():
+    steps, levels = p_plan_levels([p_step('a', group='g'), p_step('b', group='g')], FUNCS)
+    assert [s[3] for s in steps] == ['g', 'g']
+
+    with pytest.raises(ValueError):
+        p_plan_levels([p_step('a', group='g'), p_step('b', ['a'], group='g')], FUNCS)
+
+
+@pytest.mark.parametrize('steps', [
+    [p_step('a', ['b']), p_step('b', ['a'])],           # loop
+    [p_step('a', ['a'])],                               # loop on itself
+    [p_step('a', ['x'])],                               # unknown dependency
+    [p_step('a'), p_step('a')],                         # defined twice
+    [{'name': 'a', 'func': 'PICB_x'}],                  # unknown function
+])
+def test_levels_bad_plan(steps):
+    with pytest.raises(ValueError):
+        p_plan_levels(steps, FUNCS)
+
+
+def test_compile_shipped_plan():
+    path = os.path.join(ROOT, 'picb_plan.json')
+    with open(path) as f:
+        funcs = [step['func'] for step in json.load(f)['steps']]
+
+    plan = plan_compile(path, funcs)
+    consts = plan['consts']
+    assert consts['PM_BIAS_VOLT'] == pytest.approx(3.0 * ((23.2+0.133)/10.0 + 1.0))
+    assert all(rec['typ'] == rec['volt'] * rec['scale'] for rec in plan['supply'])
+    assert len(plan['steps']) == len(funcs)
+    assert len(plan['sha256']) == 64
+
+
+def test_compile_plan_hash(tmp_path):
+    path = str(tmp_path / 'plan.json')
+    sha = []
+    for limit in [1, 2, 1]:
+        with open(path, 'w') as f:
+            json.dump({'supply': [], 'pressure_sensor': {}, 'limits': {'x': limit},
+                       'steps': [p_step('a')]}, f)
+        sha.append(plan_compile(path, FUNCS)['sha256'])
+
+    assert sha[0] != sha[1]
+    assert sha[0] == sha[2]